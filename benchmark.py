@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+性能基准脚本 - 用本地模拟的 Notion / Crossref / Anthropic 服务离线测量同步吞吐量
+
+在进程内启动三个模拟HTTP服务，生成合成的订阅和文章，然后运行完整的 sync 流程，
+报告每秒处理文章数、峰值内存和各服务的请求次数。不会访问任何真实服务。
+
+用法：
+    python benchmark.py --journals 500 --articles 200 --workers 8
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+SUBSCRIPTIONS_DB = 'bench-subscriptions'
+ARTICLES_DB = 'bench-articles'
+SUMMARIES_DB = 'bench-summaries'
+
+# ============== 模拟服务 ==============
+
+class FakeService:
+    """模拟服务的公共行为：可配置的延迟、5xx 错误率和 429 限流"""
+
+    def __init__(self, name, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=0.1):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.requests[key] += 1
+
+    def inject_failure(self):
+        """按配置返回 (状态码, 响应头)，正常时返回None"""
+        if self.latency:
+            time.sleep(self.latency)
+        roll = random.random()
+        if roll < self.throttle_rate:
+            self.count('429')
+            return 429, {'Retry-After': str(self.retry_after)}
+        if roll < self.throttle_rate + self.error_rate:
+            self.count('5xx')
+            return 503, {}
+        return None
+
+def make_handler(service, routes):
+    """根据路由函数构造请求处理类；路由函数返回 (状态码, 响应体, 响应头)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _handle(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+
+            failure = service.inject_failure()
+            if failure:
+                status, headers = failure
+                payload, content_type = b'{"message": "injected failure"}', 'application/json'
+            else:
+                status, payload, headers = routes(method, self.path, body)
+                content_type = headers.pop('Content-Type', 'application/json')
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PATCH(self):
+            self._handle('PATCH')
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def start_server(service, routes):
+    """在后台线程启动模拟服务，返回 (server, base_url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service, routes))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+# ---------- Crossref ----------
+
+def crossref_routes(service, articles_per_journal):
+    """/works：按 issn 过滤条件生成合成文章，支持 cursor 分页"""
+
+    def routes(method, path, body):
+        service.count('works')
+        query = parse_qs(urlparse(path).query)
+        filters = query.get('filter', [''])[0].split(',')
+        issns = [f.split(':', 1)[1] for f in filters if f.startswith('issn:')]
+        rows = int(query.get('rows', ['20'])[0])
+        offset = int(query.get('cursor', ['*'])[0].strip('*') or 0)
+
+        total = articles_per_journal * len(issns)
+        items = []
+        for index in range(offset, min(offset + rows, total)):
+            issn = issns[index // articles_per_journal]
+            k = index % articles_per_journal
+            items.append({
+                'DOI': f"10.5555/{issn}.{k}",
+                'ISSN': [issn],
+                'title': [f"Synthetic article {k} of journal {issn}"],
+                'author': [{'given': 'Ada', 'family': f"Author{k}"}],
+                'abstract': f"<jats:p>Synthetic abstract {k}. " + "Lorem ipsum dolor sit amet. " * 30 + "</jats:p>",
+                'published-online': {'date-parts': [[2026, 10]]},
+                'volume': '1',
+                'issue': str(k // 20 + 1),
+                'URL': f"https://doi.org/10.5555/{issn}.{k}",
+                'container-title': [f"Journal {issn}"],
+                'indexed': {'date-time': '2026-10-01T00:00:00Z'},
+            })
+        message = {'items': items, 'total-results': total, 'next-cursor': str(offset + rows)}
+        return 200, {'status': 'ok', 'message': message}, {}
+
+    return routes
+
+# ---------- Notion ----------
+
+SUBSCRIPTION_EDITED = '2026-01-01T00:00:00.000Z'
+
+def notion_time(value):
+    """Notion 时间戳（last_edited_time 只精确到分钟）与本地 ISO 时间统一成可比较的 datetime"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def match_filter(page, filter_obj):
+    """只实现订阅库查询用到的条件：and/or、last_edited_time、复选框、日期 before/is_empty"""
+    if not filter_obj:
+        return True
+    if 'and' in filter_obj:
+        return all(match_filter(page, f) for f in filter_obj['and'])
+    if 'or' in filter_obj:
+        return any(match_filter(page, f) for f in filter_obj['or'])
+    if filter_obj.get('timestamp') == 'last_edited_time':
+        since = filter_obj['last_edited_time']['on_or_after']
+        return notion_time(page['last_edited_time']) >= notion_time(since)
+    prop = page['properties'].get(filter_obj['property'], {})
+    if 'checkbox' in filter_obj:
+        return prop.get('checkbox') == filter_obj['checkbox']['equals']
+    date = (prop.get('date') or {}).get('start')
+    condition = filter_obj['date']
+    if condition.get('is_empty'):
+        return not date
+    return bool(date) and date < condition['before']
+
+def notion_routes(service, journal_count):
+    """databases/{id}、databases/{id}/query 与 pages：订阅库返回合成订阅（PATCH 会更新属性和 last_edited_time），其余库返回空结果"""
+
+    def subscription_page(i):
+        return {
+            'object': 'page',
+            'id': f"sub-{i}",
+            'last_edited_time': SUBSCRIPTION_EDITED,
+            'properties': {
+                '是否启用订阅': {'checkbox': True},
+                'Journal': {'title': [{'text': {'content': f"Journal {i}"}}]},
+                'Online ISSN': {'rich_text': [{'text': {'content': f"{i:04d}-0000"}}]},
+                'Print ISSN': {'rich_text': []},
+                '起始抓取日期': {'date': {'start': '2026-01-01'}},
+                '最后更新日期': {'date': None},
+                '增量同步时间': {'date': None},
+                '最近处理日期': {'date': None},
+                '最近处理状态': {'rich_text': []},
+            }
+        }
+
+    subscriptions = {f"sub-{i}": subscription_page(i) for i in range(journal_count)}
+    lock = threading.Lock()
+
+    # 数据库结构：{列名: {'type': 类型}}，只列出同步时检查的列
+    schemas = {
+        SUBSCRIPTIONS_DB: {name: {'type': next(iter(prop))} for name, prop in subscription_page(0)['properties'].items()},
+        ARTICLES_DB: {'Title': {'type': 'title'}, 'DOI': {'type': 'rich_text'}},
+        SUMMARIES_DB: {'Journal': {'type': 'title'}},
+    }
+
+    def routes(method, path, body):
+        parts = urlparse(path).path.strip('/').split('/')
+        if method == 'GET' and parts[-2] == 'databases':
+            service.count(f"schema:{parts[-1]}")
+            if parts[-1] not in schemas:
+                return 404, {'message': 'not found'}, {}
+            return 200, {'object': 'database', 'id': parts[-1], 'properties': schemas[parts[-1]]}, {}
+        if method == 'POST' and parts[-1] == 'query':
+            database_id = parts[-2]
+            service.count(f"query:{database_id}")
+            if database_id != SUBSCRIPTIONS_DB:
+                return 200, {'results': [], 'has_more': False, 'next_cursor': None}, {}
+            with lock:
+                matched = [page for page in subscriptions.values() if match_filter(page, body.get('filter'))]
+                matched = json.loads(json.dumps(matched))
+            page_size = body.get('page_size', 100)
+            start = int(body.get('start_cursor') or 0)
+            end = min(start + page_size, len(matched))
+            has_more = end < len(matched)
+            return 200, {
+                'results': matched[start:end],
+                'has_more': has_more,
+                'next_cursor': str(end) if has_more else None
+            }, {}
+        if method == 'POST' and parts[-1] == 'pages':
+            database_id = body['parent']['database_id']
+            service.count(f"create:{database_id}")
+            return 200, {'object': 'page', 'id': f"page-{random.getrandbits(64):x}"}, {}
+        if method == 'PATCH':
+            service.count('update')
+            with lock:
+                page = subscriptions.get(parts[-1])
+                if page is None:
+                    return 200, {'object': 'page', 'id': parts[-1]}, {}
+                page['properties'].update(body.get('properties', {}))
+                edited = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+                page['last_edited_time'] = edited.strftime('%Y-%m-%dT%H:%M:00.000Z')
+                return 200, json.loads(json.dumps(page)), {}
+        return 404, {'message': 'not found'}, {}
+
+    return routes
+
+# ---------- Anthropic ----------
+
+def fake_completion(params):
+    """根据提示词类型生成合法的模型输出文本"""
+    content = params['messages'][0]['content']
+    if isinstance(content, list):
+        content = '\n'.join(block.get('text', '') for block in content)
+    system = params.get('system', '')
+    if isinstance(system, list):
+        system = '\n'.join(block.get('text', '') for block in system)
+
+    for line in content.splitlines():
+        if line.startswith('[{'):
+            items = json.loads(line)
+            return json.dumps([
+                {'doi': i['doi'], 'title_cn': f"中文标题 {i['title']}",
+                 'abstract_cn': '中文摘要' if i.get('abstract') else ''}
+                for i in items
+            ], ensure_ascii=False)
+    if '小结' in content or '小结' in system:
+        return '本期文章主要关注合成数据上的基准测试。'
+    if '摘要：' in content:
+        return json.dumps({'title_cn': '中文标题', 'abstract_cn': '中文摘要'}, ensure_ascii=False)
+    return '中文标题'
+
+# 模拟提示词缓存：带 cache_control 的 system 前缀第一次出现时写入，之后读取（与真实服务一样有最小长度）
+CACHE_MIN_TOKENS = 1024
+_prompt_cache = set()
+_prompt_cache_lock = threading.Lock()
+
+def fake_usage(params, text):
+    total = len(json.dumps(params, ensure_ascii=False)) // 4
+    usage = {'input_tokens': total, 'output_tokens': len(text) // 2,
+             'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+    system = params.get('system')
+    if not isinstance(system, list) or not any('cache_control' in block for block in system):
+        return usage
+    prefix = json.dumps(system, ensure_ascii=False)
+    prefix_tokens = len(prefix) // 4
+    if prefix_tokens < CACHE_MIN_TOKENS:
+        return usage
+    with _prompt_cache_lock:
+        hit = prefix in _prompt_cache
+        _prompt_cache.add(prefix)
+    usage['cache_read_input_tokens' if hit else 'cache_creation_input_tokens'] = prefix_tokens
+    usage['input_tokens'] = total - prefix_tokens
+    return usage
+
+def fake_message(params):
+    text = fake_completion(params)
+    return {
+        'id': f"msg_{random.getrandbits(64):x}",
+        'type': 'message',
+        'role': 'assistant',
+        'model': params.get('model', 'fake'),
+        'content': [{'type': 'text', 'text': text}],
+        'stop_reason': 'end_turn',
+        'stop_sequence': None,
+        'usage': fake_usage(params, text)
+    }
+
+def anthropic_routes(service, base_url_holder):
+    """/v1/messages 以及 Message Batches 的创建、查询和结果接口（批处理立即完成）"""
+    batches = {}
+    lock = threading.Lock()
+
+    def batch_object(batch_id):
+        count = len(batches[batch_id])
+        return {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'ended',
+            'request_counts': {'processing': 0, 'succeeded': count, 'errored': 0, 'canceled': 0, 'expired': 0},
+            'created_at': '2026-01-01T00:00:00Z',
+            'expires_at': '2026-01-02T00:00:00Z',
+            'ended_at': '2026-01-01T00:00:01Z',
+            'archived_at': None,
+            'cancel_initiated_at': None,
+            'results_url': f"{base_url_holder[0]}/v1/messages/batches/{batch_id}/results"
+        }
+
+    def routes(method, path, body):
+        parts = urlparse(path).path.strip('/').split('/')
+        if method == 'POST' and parts == ['v1', 'messages']:
+            service.count('messages')
+            return 200, fake_message(body), {}
+        if method == 'POST' and parts == ['v1', 'messages', 'batches']:
+            service.count('batches.create')
+            with lock:
+                batch_id = f"msgbatch_{len(batches)}"
+                batches[batch_id] = body['requests']
+            return 200, batch_object(batch_id), {}
+        if method == 'GET' and len(parts) == 5 and parts[-1] == 'results':
+            service.count('batches.results')
+            lines = [
+                json.dumps({'custom_id': r['custom_id'],
+                            'result': {'type': 'succeeded', 'message': fake_message(r['params'])}},
+                           ensure_ascii=False)
+                for r in batches[parts[3]]
+            ]
+            return 200, '\n'.join(lines).encode('utf-8'), {'Content-Type': 'application/binary'}
+        if method == 'GET' and len(parts) == 4:
+            service.count('batches.retrieve')
+            return 200, batch_object(parts[3]), {}
+        if method == 'POST' and parts[-1] == 'cancel':
+            return 200, batch_object(parts[3]), {}
+        return 404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': 'not found'}}, {}
+
+    return routes
+
+# ============== 基准流程 ==============
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="用本地模拟服务测量期刊同步的吞吐量")
+    parser.add_argument('--journals', type=int, default=20, help="合成订阅数（默认20）")
+    parser.add_argument('--articles', type=int, default=50, help="每个期刊的文章数（默认50）")
+    parser.add_argument('--workers', type=int, default=1, help="sync 的并发期刊数")
+    parser.add_argument('--notion-rate-limit', type=float, default=1000.0,
+                        help="Notion客户端的限流（次/秒，默认1000；设为3可模拟真实限流）")
+    parser.add_argument('--latency', type=float, default=0.0, help="所有模拟服务的单次延迟（秒）")
+    parser.add_argument('--notion-latency', type=float, help="Notion模拟服务的延迟（覆盖 --latency）")
+    parser.add_argument('--crossref-latency', type=float, help="Crossref模拟服务的延迟（覆盖 --latency）")
+    parser.add_argument('--claude-latency', type=float, help="Anthropic模拟服务的延迟（覆盖 --latency）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="各模拟服务返回 503 的概率")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="各模拟服务返回 429 的概率")
+    parser.add_argument('--retry-after', type=float, default=0.1, help="429 响应的 Retry-After 秒数")
+    parser.add_argument('--message-batches', action='store_true', help="使用 Message Batches 离线批处理模式")
+    parser.add_argument('--sinks', help="输出目标（同 OUTPUT_SINKS，例如 sqlite:bench.sqlite3,jsonl:bench），"
+                                        "相对路径位于临时目录中")
+    parser.add_argument('--verbose', action='store_true', help="显示同步过程的输出")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    random.seed(0)
+
+    def service(name, latency):
+        return FakeService(name, latency=args.latency if latency is None else latency,
+                           error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                           retry_after=args.retry_after)
+
+    crossref = service('crossref', args.crossref_latency)
+    notion = service('notion', args.notion_latency)
+    claude = service('anthropic', args.claude_latency)
+
+    servers = []
+    server, crossref_url = start_server(crossref, crossref_routes(crossref, args.articles))
+    servers.append(server)
+    server, notion_url = start_server(notion, notion_routes(notion, args.journals))
+    servers.append(server)
+    anthropic_url = ['']
+    server, anthropic_url[0] = start_server(claude, anthropic_routes(claude, anthropic_url))
+    servers.append(server)
+
+    state_dir = tempfile.mkdtemp(prefix='paperalert-bench-')
+    os.environ.update({
+        'NOTION_API_KEY': 'bench',
+        'NOTION_BASE_URL': notion_url,
+        'NOTION_RATE_LIMIT': str(args.notion_rate_limit),
+        'NOTION_DB_SUBSCRIPTIONS': SUBSCRIPTIONS_DB,
+        'NOTION_DB_ARTICLES': ARTICLES_DB,
+        'NOTION_DB_SUMMARIES': SUMMARIES_DB,
+        'ANTHROPIC_API_KEY': 'bench',
+        'ANTHROPIC_BASE_URL': anthropic_url[0],
+        'ANTHROPIC_MESSAGE_BATCHES': '1' if args.message_batches else '0',
+        'CROSSREF_API_URL': f"{crossref_url}/works",
+        'PAPERALERT_STATE_DIR': state_dir,
+        'METRICS_RUN_LOG': os.path.join(state_dir, 'run.log'),
+        'METRICS_PROM_FILE': os.path.join(state_dir, 'metrics.prom'),
+    })
+    if args.sinks:
+        os.environ['OUTPUT_SINKS'] = args.sinks
+    # 不读取本地 config.json，只使用上面的环境变量
+    os.chdir(state_dir)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import journal_subscription_v2 as sync
+
+    print("=" * 60)
+    print("期刊订阅系统 - 性能基准")
+    print("=" * 60)
+    print(f"工作负载: {args.journals} 个期刊 × {args.articles} 篇文章, workers={args.workers}")
+
+    stdout = sys.stdout
+    started = time.perf_counter()
+    try:
+        if not args.verbose:
+            sys.stdout = open(os.devnull, 'w')
+        sync.main(['sync', '--skip-clean', '--workers', str(args.workers)])
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+    elapsed = time.perf_counter() - started
+
+    for server in servers:
+        server.shutdown()
+
+    pushed = int(sync.metrics.total('paperalert_outbox_writes_total', kind='article', result='ok'))
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"\n耗时: {elapsed:.2f} 秒")
+    print(f"推送文章: {pushed} 篇（{pushed / elapsed:.1f} 篇/秒）")
+    print(f"峰值内存: {peak_rss_mb:.1f} MB（含模拟服务）")
+    for fake in (crossref, notion, claude):
+        total = sum(v for k, v in fake.requests.items() if k not in ('429', '5xx'))
+        detail = ', '.join(f"{k}={v}" for k, v in sorted(fake.requests.items()))
+        print(f"{fake.name} 请求: {total} 次（{detail}）")
+    tokens = {kind: int(sync.metrics.total('paperalert_claude_tokens_total', type=kind))
+              for kind in ('input', 'output', 'cache_write', 'cache_read')}
+    print(f"Claude token: 输入 {tokens['input']}, 输出 {tokens['output']}, "
+          f"提示词缓存写入 {tokens['cache_write']}, 缓存读取 {tokens['cache_read']}")
+    print(f"运行日志和指标: {state_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,34 @@
 """
 期刊订阅系统 v2.0 - 使用Notion官方API
 自动抓取和推送学术期刊文章
+
+用法：
+    python journal_subscription_v2.py [sync|fetch-only|translate-only|clean|dry-run|replay]
+    python journal_subscription_v2.py sync --resume    # 从上次中断的位置继续
+    python journal_subscription_v2.py sync --shard 0/4    # 只处理4个分片中的第0片
+    python journal_subscription_v2.py merge-metrics paperalert.shard-*.prom    # 合并各分片的指标
+
+导入本模块不会创建任何API客户端，Claude/Notion客户端和本地缓存在首次使用时才初始化。
 """
 
 import os
+import io
+import sys
 import json
 import re
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import anthropic
-from habanero import Crossref
+import argparse
+import time
+import random
+import hashlib
+import sqlite3
+import threading
+import queue
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from contextlib import contextmanager
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Iterator, Iterable, Callable
 import requests
 
 # ============== 配置加载 ==============
@@ -30,98 +49,596 @@ def load_config():
             anthropic_config['base_url'] = os.getenv('ANTHROPIC_BASE_URL')
         if os.getenv('ANTHROPIC_MODEL'):
             anthropic_config['model'] = os.getenv('ANTHROPIC_MODEL')
+        if os.getenv('ANTHROPIC_MESSAGE_BATCHES'):
+            anthropic_config['message_batches'] = os.getenv('ANTHROPIC_MESSAGE_BATCHES') == '1'
+        if os.getenv('ANTHROPIC_MAX_CONCURRENCY'):
+            anthropic_config['max_concurrency'] = int(os.getenv('ANTHROPIC_MAX_CONCURRENCY'))
+
+        # Crossref 分页大小（可选）
+        crossref_config = {}
+        if os.getenv('CROSSREF_API_URL'):
+            crossref_config['api_url'] = os.getenv('CROSSREF_API_URL')
+        if os.getenv('CROSSREF_PAGE_SIZE'):
+            crossref_config['page_size'] = int(os.getenv('CROSSREF_PAGE_SIZE'))
+        if os.getenv('CROSSREF_SYNC_MODE'):
+            crossref_config['sync_mode'] = os.getenv('CROSSREF_SYNC_MODE')
+        if os.getenv('CROSSREF_COALESCE'):
+            crossref_config['coalesce'] = int(os.getenv('CROSSREF_COALESCE'))
+
+        # 并发处理期刊的线程数（可选，默认逐个处理）
+        run_config = {}
+        if os.getenv('JOURNAL_WORKERS'):
+            run_config['workers'] = int(os.getenv('JOURNAL_WORKERS'))
+
+        # 清理旧文章的并发数和时间预算（可选）
+        clean_config = {}
+        if os.getenv('CLEAN_WORKERS'):
+            clean_config['workers'] = int(os.getenv('CLEAN_WORKERS'))
+        if os.getenv('CLEAN_TIME_BUDGET'):
+            clean_config['time_budget_seconds'] = float(os.getenv('CLEAN_TIME_BUDGET'))
+
+        # 运行指标输出文件（可选，设为空字符串则不输出）
+        metrics_config = {}
+        if os.getenv('METRICS_RUN_LOG') is not None:
+            metrics_config['run_log'] = os.getenv('METRICS_RUN_LOG')
+        if os.getenv('METRICS_PROM_FILE') is not None:
+            metrics_config['prometheus_textfile'] = os.getenv('METRICS_PROM_FILE')
+
+        # 输出目标、发件箱和运行预算（可选）
+        if os.getenv('OUTPUT_SINKS'):
+            # 逗号分隔的 类型[:路径]，例如 notion,sqlite:.paperalert/articles.sqlite3
+            run_config['sinks'] = [
+                dict(zip(('type', 'path'), spec.strip().split(':', 1)))
+                for spec in os.getenv('OUTPUT_SINKS').split(',') if spec.strip()
+            ]
+        if os.getenv('OUTBOX_WRITERS'):
+            run_config['writers'] = int(os.getenv('OUTBOX_WRITERS'))
+        if os.getenv('RUN_TOKEN_BUDGET'):
+            run_config['token_budget'] = int(os.getenv('RUN_TOKEN_BUDGET'))
+        if os.getenv('RUN_TIME_BUDGET'):
+            run_config['time_budget_seconds'] = float(os.getenv('RUN_TIME_BUDGET'))
+        # 本地状态目录（翻译缓存等，可选）
+        if os.getenv('PAPERALERT_STATE_DIR'):
+            run_config['state_dir'] = os.getenv('PAPERALERT_STATE_DIR')
+        # 分片（可选，格式 i/N，例如 GitHub Actions 矩阵任务中的 0/4）
+        if os.getenv('PAPERALERT_SHARD'):
+            run_config['shard'] = os.getenv('PAPERALERT_SHARD')
+
+        notion_config = {
+            'api_key': os.getenv('NOTION_API_KEY', ''),
+            'databases': {
+                'subscriptions': os.getenv('NOTION_DB_SUBSCRIPTIONS', ''),
+                'articles': os.getenv('NOTION_DB_ARTICLES', ''),
+                'summaries': os.getenv('NOTION_DB_SUMMARIES', '')
+            }
+        }
+
+        # 自定义 Notion 端点和限流（可选，例如指向本地模拟服务）
+        if os.getenv('NOTION_BASE_URL'):
+            notion_config['base_url'] = os.getenv('NOTION_BASE_URL')
+        if os.getenv('NOTION_RATE_LIMIT'):
+            notion_config['rate_limit'] = float(os.getenv('NOTION_RATE_LIMIT'))
 
         return {
-            'notion': {
-                'api_key': os.getenv('NOTION_API_KEY', ''),
-                'databases': {
-                    'subscriptions': os.getenv('NOTION_DB_SUBSCRIPTIONS', ''),
-                    'articles': os.getenv('NOTION_DB_ARTICLES', ''),
-                    'summaries': os.getenv('NOTION_DB_SUMMARIES', '')
-                }
-            },
-            'anthropic': anthropic_config
+            'notion': notion_config,
+            'anthropic': anthropic_config,
+            'crossref': crossref_config,
+            'run': run_config,
+            'clean': clean_config,
+            'metrics': metrics_config
         }
 
 CONFIG = load_config()
 
-# 验证配置
-if not CONFIG['notion']['api_key']:
-    raise ValueError("请设置Notion API Key")
-if not CONFIG['anthropic']['api_key']:
-    raise ValueError("请设置Anthropic API Key")
-
-# 初始化客户端
-cr = Crossref()
-
-# 初始化Claude客户端（支持自定义base_url）
-anthropic_config = {'api_key': CONFIG['anthropic']['api_key']}
-if 'base_url' in CONFIG['anthropic']:
-    anthropic_config['base_url'] = CONFIG['anthropic']['base_url']
-claude_client = anthropic.Anthropic(**anthropic_config)
+# ============== 运行指标 ==============
+
+class Metrics:
+    """运行指标：调用次数、耗时直方图、重试和token计数
+
+    运行过程中把每次调用写成 JSON-lines 运行日志，结束时输出 Prometheus textfile 快照。
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._log = None
+
+    @staticmethod
+    def _key(name: str, labels: Dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def total(self, name: str, **labels) -> float:
+        """计数器在给定标签下的合计（未给出的标签不限）"""
+        wanted = set(self._key(name, labels)[1])
+        with self._lock:
+            return sum(value for (metric, key), value in self.counters.items()
+                       if metric == name and wanted <= set(key))
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.setdefault(
+                key, {'buckets': [0] * len(self.LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += seconds
+            hist['count'] += 1
+
+    def event(self, kind: str, **fields):
+        """写一行 JSON 运行日志"""
+        if self._log is None:
+            return
+        line = json.dumps({'ts': datetime.now(timezone.utc).isoformat(), 'event': kind, **fields},
+                          ensure_ascii=False, default=str)
+        with self._lock:
+            self._log.write(line + '\n')
+
+    @contextmanager
+    def timed(self, stage: str, **labels):
+        """记录一次外部调用的耗时和结果"""
+        start = time.monotonic()
+        status = 'ok'
+        try:
+            yield
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            seconds = time.monotonic() - start
+            self.inc('paperalert_calls_total', stage=stage, status=status, **labels)
+            self.observe('paperalert_call_seconds', seconds, stage=stage, **labels)
+            self.event('call', stage=stage, status=status, seconds=round(seconds, 4), **labels)
+
+    def open_log(self, path: str):
+        if path:
+            self._log = open(path, 'a', encoding='utf-8')
+
+    def close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    @staticmethod
+    def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+        items = list(labels) + list(extra)
+        if not items:
+            return ''
+        escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items]
+        return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+    def prometheus_text(self) -> str:
+        """按 Prometheus textfile 格式输出当前指标"""
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({k[0] for k in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for name in sorted({k[0] for k in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), hist in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.LATENCY_BUCKETS, hist['buckets']):
+                        lines.append(f"{name}_bucket{self._format_labels(labels, (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {hist['count']}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {hist['sum']:.6f}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """原子地写出 Prometheus textfile（先写临时文件再替换）"""
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+metrics = Metrics()
+
+def merge_prometheus(paths: List[str]) -> str:
+    """合并多个分片的 Prometheus textfile：计数器和直方图按序列相加，
+    gauge 不能相加，加上 shard 标签（取自文件名中的 shard-i-of-N）后分别保留"""
+    types = {}
+    samples = {}
+    for path in paths:
+        match = re.search(r'shard-\d+-of-\d+', os.path.basename(path))
+        shard = match.group(0) if match else os.path.basename(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('# TYPE '):
+                    _, _, name, kind = line.split(' ', 3)
+                    types.setdefault(name, kind)
+                    continue
+                if not line or line.startswith('#'):
+                    continue
+                series, value = line.rsplit(' ', 1)
+                name = series.split('{', 1)[0]
+                base = name if name in types else re.sub(r'_(bucket|sum|count)$', '', name)
+                if types.get(base) == 'gauge':
+                    labels = series[len(name):].strip('{}')
+                    series = f'{name}{{shard="{shard}"{"," + labels if labels else ""}}}'
+                    samples.setdefault(base, {})[series] = float(value)
+                else:
+                    group = samples.setdefault(base, {})
+                    group[series] = group.get(series, 0) + float(value)
+
+    lines = []
+    for base, group in samples.items():
+        lines.append(f"# TYPE {base} {types.get(base, 'untyped')}")
+        lines.extend(f"{series} {int(value) if value.is_integer() else value}" for series, value in group.items())
+    return '\n'.join(lines) + '\n'
+
+METRICS_RUN_LOG = CONFIG.get('metrics', {}).get('run_log', 'paperalert-run.log')
+METRICS_PROM_FILE = CONFIG.get('metrics', {}).get('prometheus_textfile', 'paperalert.prom')
+
+# 客户端按需创建：导入模块时不检查密钥、不导入SDK
+_client_lock = threading.Lock()
+_claude_client = None
+_notion_client = None
+_translation_cache = None
+_run_checkpoint = None
+_issue_state = None
+_subscription_snapshot = None
+_outbox_writer = None
+_sinks = None
+_notion_schemas = {}
+
+def get_claude_client():
+    """获取Claude客户端（首次调用时导入anthropic并初始化，支持自定义base_url）"""
+    global _claude_client
+    with _client_lock:
+        if _claude_client is None:
+            if not CONFIG['anthropic']['api_key']:
+                raise ValueError("请设置Anthropic API Key")
+
+            import anthropic
+
+            anthropic_config = {'api_key': CONFIG['anthropic']['api_key']}
+            if 'base_url' in CONFIG['anthropic']:
+                anthropic_config['base_url'] = CONFIG['anthropic']['base_url']
+            _claude_client = anthropic.Anthropic(**anthropic_config)
+    return _claude_client
 
 # 获取模型名称（使用配置中的模型或默认值）
 CLAUDE_MODEL = CONFIG['anthropic'].get('model', 'claude-sonnet-4-20250514')
 
+# 批量翻译：每次请求最多的文章数（1 表示逐篇翻译）和输入token预算
+TRANSLATION_BATCH_SIZE = max(int(CONFIG['anthropic'].get('batch_size', 20)), 1)
+TRANSLATION_BATCH_TOKENS = int(CONFIG['anthropic'].get('batch_token_budget', 3000))
+
+# 期刊小结：文章较多的一期先按输入token预算分组、并发生成各组要点，再合并成最终小结
+SUMMARY_CHUNK_TOKENS = int(CONFIG['anthropic'].get('summary_chunk_tokens', 8000))
+SUMMARY_WORKERS = max(int(CONFIG['anthropic'].get('summary_workers', 4)), 1)
+SUMMARY_ABSTRACT_CHARS = 1200
+
+# Claude 请求的自适应并发：上限在 1 和 max_concurrency 之间按延迟和限流自动调整；
+# 429/529、5xx 和连接错误最多重试 max_retries 次
+CLAUDE_MAX_CONCURRENCY = max(int(CONFIG['anthropic'].get('max_concurrency', 8)), 1)
+CLAUDE_INITIAL_CONCURRENCY = max(int(CONFIG['anthropic'].get('initial_concurrency', 2)), 1)
+CLAUDE_MAX_RETRIES = int(CONFIG['anthropic'].get('max_retries', 6))
+CLAUDE_LATENCY_TARGET = float(CONFIG['anthropic'].get('latency_target_seconds', 60))
+
+# Message Batches 离线模式：整次运行的翻译和小结作为一个异步批处理提交（默认关闭）；
+# 等待时间默认4小时，留出同步回退和写入的时间（GitHub Actions 任务上限为330分钟），同时不超过运行的时间预算
+MESSAGE_BATCH_MODE = bool(CONFIG['anthropic'].get('message_batches', False))
+MESSAGE_BATCH_POLL_SECONDS = float(CONFIG['anthropic'].get('message_batch_poll_seconds', 30))
+MESSAGE_BATCH_TIMEOUT_SECONDS = float(CONFIG['anthropic'].get('message_batch_timeout_seconds', 4 * 3600))
+
+# Crossref cursor 深度分页：每页条数（Crossref 上限为1000）
+CROSSREF_API_URL = CONFIG.get('crossref', {}).get('api_url', "https://api.crossref.org/works")
+CROSSREF_MAX_PAGE_SIZE = 1000
+CROSSREF_PAGE_SIZE = min(int(CONFIG.get('crossref', {}).get('page_size', 200)), CROSSREF_MAX_PAGE_SIZE)
+CROSSREF_SELECT = ['DOI', 'title', 'author', 'abstract', 'published-print',
+                   'published-online', 'volume', 'issue', 'URL', 'container-title',
+                   'indexed', 'deposited', 'ISSN']
+
+# 合并查询：抓取窗口相同的期刊每次最多合并多少个ISSN到一个查询（1 表示逐个期刊查询）
+CROSSREF_COALESCE = max(int(CONFIG.get('crossref', {}).get('coalesce', 1)), 1)
+
+# 抓取窗口：pub-date 按出版日期（默认）；index-date / update-date 按Crossref索引/更新时间增量同步
+CROSSREF_SYNC_MODE = CONFIG.get('crossref', {}).get('sync_mode', 'pub-date')
+# 增量同步模式 → 记录水位线使用的文章时间字段
+CROSSREF_SYNC_FIELDS = {'index-date': 'indexed', 'update-date': 'deposited'}
+if CROSSREF_SYNC_MODE != 'pub-date' and CROSSREF_SYNC_MODE not in CROSSREF_SYNC_FIELDS:
+    raise ValueError(f"不支持的同步模式: {CROSSREF_SYNC_MODE}")
+
+# 清理旧文章：同时归档的页面数、单次运行的时间预算（秒，0 表示不限）
+CLEAN_WORKERS = max(int(CONFIG.get('clean', {}).get('workers', 4)), 1)
+# sync 运行前自动清理时保留的天数（按"上传日期"）
+ARTICLE_RETENTION_DAYS = 30
+CLEAN_TIME_BUDGET = float(CONFIG.get('clean', {}).get('time_budget_seconds', 0))
+
+# 同时处理的期刊数（1 表示逐个处理）
+JOURNAL_WORKERS = max(int(CONFIG.get('run', {}).get('workers', 1)), 1)
+
+# 输出目标：文章和小结写到哪里（默认只写入Notion），可同时写入多个
+OUTPUT_SINKS = CONFIG.get('run', {}).get('sinks') or [{'type': 'notion'}]
+
+# 发件箱写入输出目标的线程数，以及单个条目在一次运行中的最多尝试次数（失败的条目留到下次运行）
+OUTBOX_WRITERS = max(int(CONFIG.get('run', {}).get('writers', 2)), 1)
+OUTBOX_MAX_ATTEMPTS = max(int(CONFIG.get('run', {}).get('write_attempts', 5)), 1)
+
+# 整次运行的预算（0 表示不限）：估算的Claude token数和运行时间，超出的文章推迟到下次运行
+RUN_TOKEN_BUDGET = int(CONFIG.get('run', {}).get('token_budget', 0))
+RUN_TIME_BUDGET = float(CONFIG.get('run', {}).get('time_budget_seconds', 0))
+
+# 从上次中断的位置继续（sync --resume）：跳过已完成的期刊、已写入的文章和小结
+RESUME_RUN = False
+
+# 本地状态目录：翻译缓存、断点续跑记录、发件箱等跨运行保存的数据
+STATE_DIR = CONFIG.get('run', {}).get('state_dir', '.paperalert')
+
+# 订阅快照：每次只读取上次之后修改过的订阅；超过这个天数重新全量读取（0 表示每次都全量读取）。
+# 默认值不是每周定时任务间隔的整数倍，避免定时任务的时间抖动决定是否全量读取
+SUBSCRIPTION_REFRESH_DAYS = float(CONFIG.get('run', {}).get('subscription_refresh_days', 10))
+
+# 分片运行（--shard i/N）：按 page_id 的稳定哈希只处理第 i 片订阅；None 表示不分片
+SHARD = CONFIG.get('run', {}).get('shard')
+RUN_SHARD = None
+
+def parse_shard(text: str) -> tuple:
+    """解析 i/N 形式的分片（0 <= i < N）"""
+    try:
+        index, count = (int(part) for part in str(text).split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N，例如 0/4: {text}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"分片序号应在 0 到 {count - 1} 之间: {text}")
+    return index, count
+
+def subscription_shard(page_id: str, count: int) -> int:
+    """订阅所属的分片：page_id 的稳定哈希（不受 Python 哈希随机化和 id 中的连字符影响）"""
+    digest = hashlib.sha256(page_id.replace('-', '').lower().encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % count
+
+def shard_file(path: str, shard: tuple) -> str:
+    """分片各自的输出文件：paperalert-run.log → paperalert-run.shard-0-of-4.log"""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+def use_shard(shard: tuple):
+    """本次运行只处理一个分片：本地状态目录、运行日志和指标文件按分片区分，并行的分片互不覆盖；
+    Notion 限流按分片数均分，N 个分片同时运行时合计不超过 notion.rate_limit"""
+    global RUN_SHARD, STATE_DIR, METRICS_RUN_LOG, METRICS_PROM_FILE, NOTION_RATE_LIMIT
+    RUN_SHARD = shard
+    NOTION_RATE_LIMIT = NOTION_RATE_LIMIT / shard[1]
+    STATE_DIR = os.path.join(STATE_DIR, f"shard-{shard[0]}-of-{shard[1]}")
+    METRICS_RUN_LOG = shard_file(METRICS_RUN_LOG, shard)
+    METRICS_PROM_FILE = shard_file(METRICS_PROM_FILE, shard)
+
+def state_path(name: str) -> str:
+    """本地状态文件路径（目录不存在时自动创建）"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+NOTION_API_URL = "https://api.notion.com/v1"
 NOTION_VERSION = "2022-06-28"
-NOTION_HEADERS = {
-    "Authorization": f"Bearer {CONFIG['notion']['api_key']}",
-    "Content-Type": "application/json",
-    "Notion-Version": NOTION_VERSION
-}
+
+# Notion 限流（平均每秒请求数）：同一个 integration 的限额由所有并行的分片共用
+NOTION_RATE_LIMIT = float(CONFIG['notion'].get('rate_limit', 3.0))
+
+# ============== Notion API 客户端 ==============
+
+class TokenBucket:
+    """线程安全的令牌桶限流器"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """取一个令牌，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    delay = (1 - self._tokens) / self.rate
+                else:
+                    delay = self._paused_until - now
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float):
+        """收到限流响应后，所有线程暂停发放令牌"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._last = self._paused_until
+
+class NotionClient:
+    """共享的Notion API客户端：连接池复用、令牌桶限流、429/5xx 退避重试"""
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers: Dict, base_url: str = NOTION_API_URL, rate_limit: float = 3.0,
+                 max_retries: int = 5, backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 timeout: float = 60.0, pool_size: int = 16):
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate_limit, max(rate_limit, 1))
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.stats = {'requests': 0, 'retries': 0, 'throttled_seconds': 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, value: float = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _backoff(self, attempt: int) -> float:
+        """指数退避 + 全抖动"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_after(self, response: requests.Response) -> Optional[float]:
+        try:
+            return min(float(response.headers['Retry-After']), self.backoff_max)
+        except (KeyError, ValueError):
+            return None
+
+    def request(self, method: str, path: str, payload: Optional[Dict] = None) -> requests.Response:
+        """发送请求；429/5xx 和连接错误按退避策略重试，重试用尽后返回最后一次响应"""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        for attempt in range(self.max_retries + 1):
+            self._count('throttled_seconds', self.limiter.acquire())
+            self._count('requests')
+
+            try:
+                with metrics.timed('notion', method=method, endpoint=path.split('/')[0]):
+                    response = self.session.request(method, url, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code not in self.RETRY_STATUS or attempt == self.max_retries:
+                    return response
+                delay = self._retry_after(response) or self._backoff(attempt)
+                if response.status_code == 429:
+                    self.limiter.pause(delay)
+
+            self._count('retries')
+            self._count('throttled_seconds', delay)
+            metrics.inc('paperalert_retries_total', service='notion')
+            time.sleep(delay)
+
+    def get(self, path: str) -> requests.Response:
+        return self.request('GET', path)
+
+    def post(self, path: str, payload: Dict) -> requests.Response:
+        return self.request('POST', path, payload)
+
+    def patch(self, path: str, payload: Dict) -> requests.Response:
+        return self.request('PATCH', path, payload)
+
+def get_notion_client() -> NotionClient:
+    """获取共享的Notion客户端（首次调用时初始化）"""
+    global _notion_client
+    with _client_lock:
+        if _notion_client is None:
+            if not CONFIG['notion']['api_key']:
+                raise ValueError("请设置Notion API Key")
+
+            headers = {
+                "Authorization": f"Bearer {CONFIG['notion']['api_key']}",
+                "Content-Type": "application/json",
+                "Notion-Version": NOTION_VERSION
+            }
+            _notion_client = NotionClient(
+                headers,
+                base_url=CONFIG['notion'].get('base_url', NOTION_API_URL),
+                rate_limit=NOTION_RATE_LIMIT,
+                max_retries=int(CONFIG['notion'].get('max_retries', 5))
+            )
+    return _notion_client
 
 # ============== Notion API 操作函数 ==============
 
-def notion_query_database(database_id: str, filter_obj: Optional[Dict] = None) -> List[Dict]:
-    """查询Notion数据库"""
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
-    
-    payload = {}
+NOTION_PAGE_SIZE = 100
+
+def notion_query_database(database_id: str, filter_obj: Optional[Dict] = None,
+                          raise_on_error: bool = False) -> Iterator[Dict]:
+    """查询Notion数据库（按 start_cursor 逐页读取，惰性返回每条结果）；raise_on_error 时查询失败抛出异常"""
+    path = f"databases/{database_id}/query"
+
+    payload = {'page_size': NOTION_PAGE_SIZE}
     if filter_obj:
         payload['filter'] = filter_obj
-    
-    response = requests.post(url, headers=NOTION_HEADERS, json=payload)
-    
-    if response.status_code != 200:
-        print(f"查询数据库失败: {response.text}")
-        return []
-    
-    return response.json().get('results', [])
 
-def notion_create_page(database_id: str, properties: Dict) -> bool:
-    """在Notion数据库中创建页面"""
-    url = "https://api.notion.com/v1/pages"
-    
+    while True:
+        response = get_notion_client().post(path, payload)
+
+        if response.status_code != 200:
+            if raise_on_error:
+                raise RuntimeError(f"查询数据库失败: {response.status_code} {response.text[:200]}")
+            print(f"查询数据库失败: {response.text}")
+            return
+
+        data = response.json()
+        yield from data.get('results', [])
+
+        if not data.get('has_more') or not data.get('next_cursor'):
+            return
+        payload['start_cursor'] = data['next_cursor']
+
+def notion_database_properties(database_id: str) -> Dict[str, str]:
+    """读取数据库的列定义，返回 {列名: 类型}；每个数据库每次运行只查询一次，查询失败抛出异常"""
+    if database_id not in _notion_schemas:
+        response = get_notion_client().get(f"databases/{database_id}")
+        if response.status_code != 200:
+            raise RuntimeError(f"读取数据库结构失败: {response.status_code} {response.text[:200]}")
+        _notion_schemas[database_id] = {
+            name: prop.get('type', '') for name, prop in response.json().get('properties', {}).items()
+        }
+    return _notion_schemas[database_id]
+
+def notion_create_page(database_id: str, properties: Dict) -> Optional[str]:
+    """在Notion数据库中创建页面，成功时返回页面id"""
     payload = {
         "parent": {"database_id": database_id},
         "properties": properties
     }
     
-    response = requests.post(url, headers=NOTION_HEADERS, json=payload)
+    response = get_notion_client().post("pages", payload)
     
     if response.status_code != 200:
         print(f"创建页面失败: {response.text}")
-        return False
+        return None
     
-    return True
+    return response.json().get('id') or None
 
 def notion_update_page(page_id: str, properties: Dict) -> bool:
     """更新Notion页面"""
-    url = f"https://api.notion.com/v1/pages/{page_id}"
-
     payload = {"properties": properties}
 
-    response = requests.patch(url, headers=NOTION_HEADERS, json=payload)
+    response = get_notion_client().patch(f"pages/{page_id}", payload)
 
     return response.status_code == 200
 
 def notion_archive_page(page_id: str) -> bool:
     """归档Notion页面（移到回收站）"""
-    url = f"https://api.notion.com/v1/pages/{page_id}"
-
     payload = {"archived": True}
 
-    response = requests.patch(url, headers=NOTION_HEADERS, json=payload)
+    response = get_notion_client().patch(f"pages/{page_id}", payload)
 
     if response.status_code != 200:
         print(f"归档页面失败: {response.text}")
@@ -130,38 +647,71 @@ def notion_archive_page(page_id: str) -> bool:
     return True
 
 def read_subscriptions() -> List[Dict]:
-    """读取启用的期刊订阅"""
-    db_id = CONFIG['notion']['databases']['subscriptions']
-
-    # 查询启用订阅的期刊
-    filter_obj = {
-        "property": "是否启用订阅",
-        "checkbox": {
-            "equals": True
-        }
-    }
-
-    pages = notion_query_database(db_id, filter_obj)
-
-    subscriptions = []
-    for page in pages:
-        props = page['properties']
+    """读取启用的期刊订阅
 
-        sub = {
-            'page_id': page['id'],
-            'Journal': get_notion_title(props.get('Journal', {})),
-            'Online ISSN': get_notion_rich_text(props.get('Online ISSN', {})),
-            'Print ISSN': get_notion_rich_text(props.get('Print ISSN', {})),
-            '起始抓取日期': get_notion_date(props.get('起始抓取日期', {})),
-            '最后更新日期': get_notion_date(props.get('最后更新日期', {})),
-            '是否启用订阅': True
+    订阅保存在本地快照中；除首次和定期全量读取外，只查询上次读取之后修改过的行（last_edited_time 过滤）
+    并合并到快照，启动耗时取决于修改过的订阅数而不是订阅总数。
+    """
+    db_id = CONFIG['notion']['databases']['subscriptions']
+    snapshot = get_subscription_snapshot()
+    since = snapshot.watermark(db_id)
+    # Notion 的 last_edited_time 只精确到分钟，水位线留出余量
+    started = datetime.now(timezone.utc) - timedelta(minutes=2)
+
+    if since:
+        # 增量读取：不限制是否启用，停用的订阅也要更新到快照中
+        filter_obj = snapshot.delta_filter(since)
+    else:
+        # 全量读取：查询启用订阅的期刊
+        filter_obj = {
+            "property": "是否启用订阅",
+            "checkbox": {
+                "equals": True
+            }
         }
 
-        subscriptions.append(sub)
+    try:
+        pages = [parse_subscription(page, enabled=None if since else True)
+                 for page in notion_query_database(db_id, filter_obj, raise_on_error=True)]
+    except Exception as e:
+        print(f"读取订阅失败: {e}")
+        if not since:
+            return []
+        print("使用本地订阅快照")
+        return snapshot.enabled()
+
+    changed = snapshot.merge(db_id, pages, started.isoformat(), full=not since)
+    metrics.set('paperalert_subscriptions_read', len(pages), mode='incremental' if since else 'full')
+    if since:
+        print(f"订阅快照: 读取 {len(pages)} 行，{changed} 个订阅在上次读取后有修改")
+    return snapshot.enabled()
+
+def parse_subscription(page: Dict, enabled: Optional[bool] = None) -> Dict:
+    """把订阅库的一行转换成订阅字典；enabled 为None时从"是否启用订阅"列读取"""
+    props = page['properties']
+    if enabled is None:
+        enabled = bool(props.get('是否启用订阅', {}).get('checkbox'))
+
+    sub = {
+        'page_id': page['id'],
+        'last_edited_time': page.get('last_edited_time', ''),
+        'Journal': get_notion_title(props.get('Journal', {})),
+        'Online ISSN': get_notion_rich_text(props.get('Online ISSN', {})),
+        'Print ISSN': get_notion_rich_text(props.get('Print ISSN', {})),
+        '起始抓取日期': get_notion_date(props.get('起始抓取日期', {})),
+        '最后更新日期': get_notion_date(props.get('最后更新日期', {})),
+        '增量同步时间': get_notion_date(props.get('增量同步时间', {})),
+        '优先级': get_notion_number(props.get('优先级', {})),
+        '包含关键词': get_notion_rich_text(props.get('包含关键词', {})),
+        '排除关键词': get_notion_rich_text(props.get('排除关键词', {})),
+        '最近处理日期': get_notion_date(props.get('最近处理日期', {})),
+        '最近处理状态': get_notion_rich_text(props.get('最近处理状态', {})),
+        '是否启用订阅': enabled
+    }
 
-    return subscriptions
+    return sub
 
-def write_article(article_data: Dict) -> bool:
+def notion_write_article(article_data: Dict) -> bool:
     """写入文章到文章推送库"""
     db_id = CONFIG['notion']['databases']['articles']
     
@@ -178,13 +728,25 @@ def write_article(article_data: Dict) -> bool:
         "Abstract": {"rich_text": [{"text": {"content": article_data.get('abstract', '')[:2000]}}]},
         "摘要": {"rich_text": [{"text": {"content": article_data.get('abstract_cn', '')[:2000]}}]},
         "Link": {"url": article_data.get('url', '')[:2000] if article_data.get('url') else None},
+        "DOI": {"rich_text": [{"text": {"content": article_data.get('doi', '')[:2000]}}]},
         "上传日期": {"date": {"start": datetime.now().strftime("%Y-%m-%d")}}
     }
     
-    return notion_create_page(db_id, properties)
+    return bool(notion_create_page(db_id, properties))
+
+def find_summary_page(journal: str, volume: str, issue: str) -> Optional[str]:
+    """在小结库中查找这一期的小结页面；查询失败时抛出异常"""
+    filter_obj = {"and": [
+        {"property": "Journal", "title": {"equals": journal[:2000]}},
+        {"property": "Volume", "rich_text": {"equals": volume[:100]}},
+        {"property": "Issue", "rich_text": {"equals": issue[:100]}}
+    ]}
+    for page in notion_query_database(CONFIG['notion']['databases']['summaries'], filter_obj, raise_on_error=True):
+        return page['id']
+    return None
 
-def write_summary(summary_data: Dict) -> bool:
-    """写入期刊小结到小结库"""
+def notion_write_summary(summary_data: Dict) -> bool:
+    """写入期刊小结到小结库；这一期已有小结页面时原地更新，否则新建"""
     db_id = CONFIG['notion']['databases']['summaries']
     
     properties = {
@@ -196,20 +758,358 @@ def write_summary(summary_data: Dict) -> bool:
         "小结": {"rich_text": [{"text": {"content": summary_data.get('summary', '')[:2000]}}]},
         "小结生成日期": {"date": {"start": datetime.now().strftime("%Y-%m-%d")}}
     }
-    
-    return notion_create_page(db_id, properties)
 
-def update_subscription_status(page_id: str, journal: str, status: str, last_update: Optional[str] = None):
+    # 本地状态不能确定有没有页面时（首次运行、状态缓存丢失、上次更新失败）按期刊、卷、期在小结库中查找；
+    # 本地记录过的新期直接新建，不多查一次
+    key = (summary_data['journal'], str(summary_data.get('volume', '')), str(summary_data.get('issue', '')))
+    issues = get_issue_state()
+    page_id = issues.page_id(*key)
+    if not page_id and issues.page_unknown(*key):
+        try:
+            page_id = find_summary_page(*key)
+        except Exception as e:
+            # 不能确定页面是否存在时按写入失败处理，由发件箱重试，避免新建重复页面
+            print(f"查找小结页面失败: {e}")
+            return False
+    if page_id:
+        if notion_update_page(page_id, properties):
+            issues.record_page(*key, page_id)
+            return True
+        # 页面可能已被删除：清除记录，重试时重新查找或新建
+        print(f"更新小结页面 {page_id[:8]} 失败")
+        issues.record_page(*key, None)
+        return False
+
+    page_id = notion_create_page(db_id, properties)
+    if page_id:
+        issues.record_page(*key, page_id)
+    return bool(page_id)
+
+def subscription_has_column(name: str) -> bool:
+    """订阅表是否有某一列；读取表结构失败时按没有处理"""
+    try:
+        return name in notion_database_properties(CONFIG['notion']['databases']['subscriptions'])
+    except Exception as e:
+        print(f"读取订阅表结构失败: {e}")
+        return False
+
+def update_subscription_status(page_id: str, journal: str, status: str, last_update: Optional[str] = None,
+                               sync_watermark: Optional[str] = None):
     """更新期刊订阅表状态"""
+    values = {'最近处理日期': datetime.now().strftime("%Y-%m-%d"), '最近处理状态': status[:2000]}
+    if last_update:
+        values['最后更新日期'] = last_update
+    # "增量同步时间"是可选列：订阅表没有这一列时写入会使整次状态更新失败
+    if sync_watermark and not subscription_has_column('增量同步时间'):
+        sync_watermark = None
+    if sync_watermark:
+        values['增量同步时间'] = sync_watermark
+
+    # 与快照中的值相同时不再写入
+    snapshot = get_subscription_snapshot()
+    if snapshot.unchanged(page_id, values):
+        return
+
     properties = {
-        "最近处理日期": {"date": {"start": datetime.now().strftime("%Y-%m-%d")}},
-        "最近处理状态": {"rich_text": [{"text": {"content": status[:2000]}}]}
+        "最近处理日期": {"date": {"start": values['最近处理日期']}},
+        "最近处理状态": {"rich_text": [{"text": {"content": values['最近处理状态']}}]}
     }
     
     if last_update:
         properties["最后更新日期"] = {"date": {"start": last_update}}
-    
-    notion_update_page(page_id, properties)
+    if sync_watermark:
+        properties["增量同步时间"] = {"date": {"start": sync_watermark}}
+
+    # 状态更新失败只影响当前期刊，不向上抛出
+    try:
+        response = get_notion_client().patch(f"pages/{page_id}", {"properties": properties})
+        if response.status_code == 200:
+            # 响应是写入后的整行：记入快照，下次增量读取不必再读这次写入
+            snapshot.record_write(parse_subscription(response.json()))
+        elif response.status_code == 404 or 'archived' in response.text:
+            # 订阅行已删除：增量读取读不到已删除的行，直接从快照中移除
+            print(f"  期刊 {journal} 的订阅行已删除，从订阅快照中移除")
+            snapshot.remove(page_id)
+        else:
+            print(f"  更新期刊 {journal} 订阅状态失败")
+    except Exception as e:
+        print(f"  更新期刊 {journal} 订阅状态失败: {e}")
+
+# ============== 输出目标 ==============
+
+SINK_KINDS = ('article', 'summary')
+
+# 本地输出目标中每类记录的文件名或表名
+SINK_TABLES = {'article': 'articles', 'summary': 'summaries'}
+
+# 本地输出目标的列，顺序即 Parquet/SQLite 中的列顺序
+ARTICLE_FIELDS = ['doi', 'journal', 'title', 'title_cn', 'author', 'abstract', 'abstract_cn', 'volume', 'issue',
+                  'year', 'year_month', 'quarter', 'url']
+SUMMARY_FIELDS = ['journal', 'volume', 'issue', 'year', 'article_count', 'summary']
+
+class Sink(ABC):
+    """输出目标：翻译好的文章和期刊小结写到哪里；kinds 限定接收的记录类型（article / summary）"""
+
+    type = 'sink'
+
+    def __init__(self, kinds: Optional[Iterable[str]] = None):
+        self.kinds = set(kinds or SINK_KINDS)
+
+    @property
+    def name(self) -> str:
+        return self.type
+
+    def accepts(self, kind: str) -> bool:
+        return kind in self.kinds
+
+    def write(self, kind: str, data: Dict) -> bool:
+        if kind == 'article':
+            return self.write_article(data)
+        return self.write_summary(data)
+
+    @abstractmethod
+    def write_article(self, article_data: Dict) -> bool:
+        """写入一篇文章，成功时返回True"""
+
+    @abstractmethod
+    def write_summary(self, summary_data: Dict) -> bool:
+        """写入一期小结，成功时返回True"""
+
+    def known_dois(self) -> Iterable[str]:
+        """已写入的文章DOI，用于去重；读取不完整时应抛出异常而不是返回部分结果"""
+        return []
+
+    def check(self):
+        """同步开始前检查输出目标是否可用，不可用时抛出异常"""
+        pass
+
+    def close(self):
+        pass
+
+class NotionSink(Sink):
+    """Notion 文章推送库和小结库"""
+
+    type = 'notion'
+
+    def write_article(self, article_data: Dict) -> bool:
+        return notion_write_article(article_data)
+
+    def write_summary(self, summary_data: Dict) -> bool:
+        return notion_write_summary(summary_data)
+
+    def check(self):
+        """文章推送库必须有文本类型的 DOI 列：DOI去重依赖它，缺少时写入文章也会失败"""
+        if not self.accepts('article'):
+            return
+        properties = notion_database_properties(CONFIG['notion']['databases']['articles'])
+        if properties.get('DOI') != 'rich_text':
+            raise RuntimeError("Notion 文章推送库缺少文本类型的 DOI 列，请先在数据库中添加该列（见 README 的数据库结构）")
+
+    def known_dois(self) -> Iterable[str]:
+        filter_obj = {"property": "DOI", "rich_text": {"is_not_empty": True}}
+        for page in notion_query_database(CONFIG['notion']['databases']['articles'], filter_obj, raise_on_error=True):
+            doi = get_notion_rich_text(page['properties'].get('DOI', {}))
+            if doi:
+                yield doi
+
+class LocalSink(Sink):
+    """写入本地文件的输出目标；path 为目录（JSONL、Parquet）或数据库文件（SQLite）"""
+
+    def __init__(self, path: str, kinds: Optional[Iterable[str]] = None):
+        super().__init__(kinds)
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"{self.type}:{self.path}"
+
+    @staticmethod
+    def written_at() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+class JSONLSink(LocalSink):
+    """追加写入 articles.jsonl 和 summaries.jsonl，每条记录一行"""
+
+    type = 'jsonl'
+
+    def __init__(self, path: str, kinds: Optional[Iterable[str]] = None):
+        super().__init__(path, kinds)
+        os.makedirs(path, exist_ok=True)
+        self._files = {}
+
+    def _append(self, kind: str, data: Dict) -> bool:
+        line = json.dumps({**data, 'written_at': self.written_at()}, ensure_ascii=False, default=str)
+        with self._lock:
+            if kind not in self._files:
+                self._files[kind] = open(os.path.join(self.path, f"{SINK_TABLES[kind]}.jsonl"), 'a',
+                                         encoding='utf-8')
+            self._files[kind].write(line + '\n')
+            self._files[kind].flush()
+        return True
+
+    def write_article(self, article_data: Dict) -> bool:
+        return self._append('article', article_data)
+
+    def write_summary(self, summary_data: Dict) -> bool:
+        return self._append('summary', summary_data)
+
+    def known_dois(self) -> Iterable[str]:
+        path = os.path.join(self.path, 'articles.jsonl')
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                doi = json.loads(line).get('doi')
+                if doi:
+                    yield doi
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+class SQLiteSink(LocalSink):
+    """SQLite 数据库：文章按 DOI（无DOI时按链接或标题）、小结按 (期刊, 卷, 期) 去重写入"""
+
+    type = 'sqlite'
+
+    def __init__(self, path: str, kinds: Optional[Iterable[str]] = None):
+        super().__init__(path, kinds)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS articles (
+                    article_key TEXT PRIMARY KEY,
+                    {', '.join(f'{field} TEXT' for field in ARTICLE_FIELDS)},
+                    written_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS summaries (
+                    {', '.join(f'{field} TEXT' for field in SUMMARY_FIELDS)},
+                    written_at TEXT NOT NULL,
+                    PRIMARY KEY (journal, volume, issue)
+                )
+            """)
+
+    def _insert(self, table: str, values: List):
+        placeholders = ', '.join('?' for _ in values)
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", values)
+        return True
+
+    def write_article(self, article_data: Dict) -> bool:
+        return self._insert('articles', [article_key(article_data)]
+                            + [article_data.get(field) for field in ARTICLE_FIELDS] + [self.written_at()])
+
+    def write_summary(self, summary_data: Dict) -> bool:
+        return self._insert('summaries', [summary_data.get(field) for field in SUMMARY_FIELDS]
+                            + [self.written_at()])
+
+    def known_dois(self) -> Iterable[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT doi FROM articles WHERE doi IS NOT NULL AND doi != ''").fetchall()
+        return [row[0] for row in rows]
+
+    def rows(self, table: str) -> Iterator[Dict]:
+        """按写入顺序读出全部记录（replay 子命令用）"""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT * FROM {table} ORDER BY written_at")
+            columns = [c[0] for c in cursor.description]
+            rows = cursor.fetchall()
+        for row in rows:
+            yield dict(zip(columns, row))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ParquetSink(LocalSink):
+    """列式 Parquet 文件：记录在内存中缓冲，每次运行结束时写出一个新文件（需要安装 pyarrow）"""
+
+    type = 'parquet'
+
+    def __init__(self, path: str, kinds: Optional[Iterable[str]] = None, row_group_size: int = 10000):
+        super().__init__(path, kinds)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet 输出需要安装 pyarrow：pip install pyarrow")
+        os.makedirs(path, exist_ok=True)
+        self.row_group_size = row_group_size
+        self._rows = {'article': [], 'summary': []}
+
+    def write_article(self, article_data: Dict) -> bool:
+        row = {field: article_data.get(field) for field in ARTICLE_FIELDS}
+        row['year'] = str(row['year']) if row['year'] is not None else None
+        with self._lock:
+            self._rows['article'].append({**row, 'written_at': self.written_at()})
+        return True
+
+    def write_summary(self, summary_data: Dict) -> bool:
+        row = {field: summary_data.get(field) for field in SUMMARY_FIELDS}
+        row['year'] = str(row['year']) if row['year'] is not None else None
+        row['article_count'] = str(row['article_count']) if row['article_count'] is not None else None
+        with self._lock:
+            self._rows['summary'].append({**row, 'written_at': self.written_at()})
+        return True
+
+    def known_dois(self) -> Iterable[str]:
+        import pyarrow.parquet as pq
+
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith(f"{SINK_TABLES['article']}-") and name.endswith('.parquet'):
+                table = pq.read_table(os.path.join(self.path, name), columns=['doi'])
+                yield from (doi for doi in table.column('doi').to_pylist() if doi)
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        with self._lock:
+            for kind, rows in self._rows.items():
+                if rows:
+                    table = pa.Table.from_pylist(rows)
+                    pq.write_table(table, os.path.join(self.path, f"{SINK_TABLES[kind]}-{stamp}.parquet"),
+                                   row_group_size=self.row_group_size)
+            self._rows = {'article': [], 'summary': []}
+
+SINK_TYPES = {sink.type: sink for sink in (NotionSink, JSONLSink, SQLiteSink, ParquetSink)}
+
+def create_sink(spec: Dict) -> Sink:
+    """根据配置创建输出目标，例如 {"type": "sqlite", "path": "...", "kinds": ["article"]}"""
+    sink_type = spec.get('type')
+    if sink_type not in SINK_TYPES:
+        raise ValueError(f"未知的输出目标类型: {sink_type}（可选 {', '.join(SINK_TYPES)}）")
+    if sink_type == 'notion':
+        return NotionSink(spec.get('kinds'))
+    if not spec.get('path'):
+        raise ValueError(f"输出目标 {sink_type} 需要指定 path")
+    return SINK_TYPES[sink_type](spec['path'], spec.get('kinds'))
+
+def get_sinks() -> List[Sink]:
+    """获取配置的输出目标（首次调用时创建），默认只写入Notion"""
+    global _sinks
+    with _client_lock:
+        if _sinks is None:
+            _sinks = [create_sink(spec) for spec in OUTPUT_SINKS]
+    return _sinks
+
+def close_sinks():
+    """关闭输出目标（Parquet 在这里写出文件）"""
+    global _sinks
+    with _client_lock:
+        sinks, _sinks = _sinks, None
+    for sink in sinks or []:
+        try:
+            sink.close()
+        except Exception as e:
+            print(f"关闭输出目标 {sink.name} 失败: {e}")
 
 # ============== Notion数据提取辅助函数 ==============
 
@@ -231,6 +1131,10 @@ def get_notion_date(prop: Dict) -> Optional[str]:
         return prop['date']['start']
     return None
 
+def get_notion_number(prop: Dict) -> Optional[float]:
+    """从Notion number属性提取数值"""
+    return prop.get('number')
+
 # ============== 文本清理辅助函数 ==============
 
 def clean_html_tags(text: str) -> str:
@@ -249,34 +1153,73 @@ def clean_html_tags(text: str) -> str:
 
     return text
 
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """解析 Crossref/Notion 的日期或时间字符串，统一为UTC时间"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
 # ============== Crossref API 函数 ==============
 
-def fetch_articles_by_issn(issn: str, from_date: str, until_date: Optional[str] = None) -> List[Dict]:
-    """根据ISSN抓取文章"""
+def iter_articles_by_issns(issns: List[str], from_date: str, until_date: Optional[str] = None,
+                           page_size: Optional[int] = None, date_filter: str = 'pub-date',
+                           extra_filters: Optional[Dict[str, str]] = None) -> Iterator[Dict]:
+    """根据一个或多个ISSN流式抓取文章（cursor深度分页，逐页解析，内存只保留当前页）
+
+    多个ISSN在同一个查询中按"或"合并。date_filter 决定日期窗口作用的字段：
+    pub-date（出版日期）、index-date 或 update-date。
+    """
     if not until_date:
         until_date = datetime.now().strftime("%Y-%m-%d")
-    
+
+    filters = [f"issn:{issn}" for issn in issns]
+    filters += [f"from-{date_filter}:{from_date}", f"until-{date_filter}:{until_date}"]
+    for name, value in (extra_filters or {}).items():
+        filters.append(f"{name}:{value}")
+
+    rows = min(page_size or CROSSREF_PAGE_SIZE, CROSSREF_MAX_PAGE_SIZE)
+    params = {
+        'filter': ','.join(filters),
+        'select': ','.join(CROSSREF_SELECT),
+        'rows': rows,
+        'cursor': '*'
+    }
+
+    while True:
+        with metrics.timed('crossref'):
+            response = requests.get(CROSSREF_API_URL, params=params, timeout=60)
+            response.raise_for_status()
+
+        message = response.json().get('message', {})
+        items = message.get('items', [])
+
+        metrics.inc('paperalert_crossref_items_total', len(items))
+        for item in items:
+            article = parse_crossref_item(item)
+            if article:
+                yield article
+
+        # 最后一页：条数不足一页或没有下一页游标
+        next_cursor = message.get('next-cursor')
+        if not next_cursor or len(items) < rows:
+            return
+        params['cursor'] = next_cursor
+
+def iter_articles_by_issn(issn: str, from_date: str, until_date: Optional[str] = None,
+                          **kwargs) -> Iterator[Dict]:
+    """根据ISSN流式抓取文章"""
+    return iter_articles_by_issns([issn], from_date, until_date, **kwargs)
+
+def fetch_articles_by_issn(issn: str, from_date: str, until_date: Optional[str] = None) -> List[Dict]:
+    """根据ISSN抓取全部文章"""
     try:
-        works = cr.works(
-            filter={
-                'issn': issn,
-                'from-pub-date': from_date,
-                'until-pub-date': until_date
-            },
-            limit=100,
-            select=['DOI', 'title', 'author', 'abstract', 'published-print', 
-                   'published-online', 'volume', 'issue', 'URL', 'container-title']
-        )
-        
-        articles = []
-        if works and 'message' in works and 'items' in works['message']:
-            for item in works['message']['items']:
-                article = parse_crossref_item(item)
-                if article:
-                    articles.append(article)
-        
-        return articles
-        
+        return list(iter_articles_by_issn(issn, from_date, until_date))
     except Exception as e:
         print(f"抓取ISSN {issn} 文章失败: {e}")
         return []
@@ -318,6 +1261,9 @@ def parse_crossref_item(item: Dict) -> Optional[Dict]:
         journal = item.get('container-title', [''])[0] if 'container-title' in item else ''
         doi = item.get('DOI', '')
         url = item.get('URL', f"https://doi.org/{doi}" if doi else '')
+        issns = [i.upper() for i in item.get('ISSN', [])]
+        indexed = item.get('indexed', {}).get('date-time', '')
+        deposited = item.get('deposited', {}).get('date-time', '')
         
         year = int(pub_date.split('-')[0]) if pub_date else None
         year_month = pub_date if pub_date else ''
@@ -340,32 +1286,1053 @@ def parse_crossref_item(item: Dict) -> Optional[Dict]:
             'quarter': quarter,
             'doi': doi,
             'url': url,
-            'pub_date': pub_date
+            'pub_date': pub_date,
+            'issns': issns,
+            'indexed': indexed,
+            'deposited': deposited
         }
         
     except Exception as e:
         print(f"解析文章数据失败: {e}")
         return None
 
+# ============== 关键词过滤 ==============
+
+class KeywordFilter:
+    """订阅的包含/排除关键词：编译成两个合并的正则，在翻译前按标题和摘要过滤文章
+
+    关键词不区分大小写，按整词匹配；以 * 结尾表示前缀匹配（如 immun* 匹配 immune、immunity）。
+    设置了包含关键词时，文章至少命中一个才保留；命中任一排除关键词的文章跳过。
+    """
+
+    SEPARATORS = re.compile(r'[,，;；\n]+')
+
+    def __init__(self, include: str = '', exclude: str = ''):
+        self.include = self.compile(include)
+        self.exclude = self.compile(exclude)
+        self.stats = {'matched': 0, 'skipped': 0}
+
+    @property
+    def active(self) -> bool:
+        return bool(self.include or self.exclude)
+
+    @classmethod
+    def compile(cls, rules: str) -> Optional[re.Pattern]:
+        """把逗号/分号/换行分隔的关键词编译成一个正则，长的关键词优先"""
+        # 只有 * 的规则（去掉 * 后为空）会匹配所有文章，忽略
+        terms = sorted({t.strip() for t in cls.SEPARATORS.split(rules or '') if t.strip().rstrip('*')},
+                       key=len, reverse=True)
+        if not terms:
+            return None
+        patterns = []
+        for term in terms:
+            prefix = term.endswith('*')
+            term = term.rstrip('*')
+            pattern = re.escape(term)
+            if term[:1].isalnum():
+                pattern = r'\b' + pattern
+            if prefix:
+                pattern += r'\w*'
+            elif term[-1:].isalnum():
+                pattern += r'\b'
+            patterns.append(pattern)
+        return re.compile('|'.join(patterns), re.IGNORECASE)
+
+    def matches(self, article: Dict) -> bool:
+        text = f"{clean_html_tags(article.get('title', ''))}\n{article.get('abstract', '')}"
+        if self.include and not self.include.search(text):
+            return False
+        return not (self.exclude and self.exclude.search(text))
+
+    def apply(self, articles: Iterable[Dict], journal: str = '') -> Iterator[Dict]:
+        """只返回符合规则的文章，并统计匹配和跳过的数量"""
+        for article in articles:
+            result = 'matched' if self.matches(article) else 'skipped'
+            self.stats[result] += 1
+            metrics.inc('paperalert_keyword_filter_total', journal=journal, result=result)
+            if result == 'matched':
+                yield article
+
+# ============== DOI去重索引 ==============
+
+class DOIIndex:
+    """已推送文章的DOI索引：每次运行从接收文章的输出目标加载一次，在翻译前剔除已推送的文章"""
+
+    def __init__(self):
+        self.stats = {'known': 0, 'skipped': 0}
+        self._dois = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(doi: str) -> str:
+        return doi.strip().lower()
+
+    def load(self):
+        """从输出目标加载已推送的DOI；任一输出目标读取失败时抛出异常，索引保持未加载"""
+        with self._lock:
+            if self._loaded:
+                return
+            dois = set()
+            for sink in get_sinks():
+                if sink.accepts('article'):
+                    dois.update(self.normalize(doi) for doi in sink.known_dois())
+            self._dois.update(dois)
+            self.stats['known'] = len(self._dois)
+            self._loaded = True
+            print(f"  已加载 {len(self._dois)} 个已推送文章的DOI")
+
+    def add(self, doi: str):
+        """记录刚写入的DOI"""
+        if doi:
+            with self._lock:
+                self._dois.add(self.normalize(doi))
+
+    def filter_new(self, articles: Iterable[Dict]) -> Iterator[Dict]:
+        """只返回未推送过的文章；同一次运行中重复出现的DOI也只保留一次"""
+        self.load()
+        for article in articles:
+            doi = self.normalize(article.get('doi', ''))
+            if doi:
+                with self._lock:
+                    if doi in self._dois:
+                        self.stats['skipped'] += 1
+                        continue
+                    self._dois.add(doi)
+            yield article
+
+doi_index = DOIIndex()
+
+# ============== 本地翻译缓存 ==============
+
+class TranslationCache:
+    """本地翻译缓存（SQLite）：(DOI, 标题+摘要哈希, 模型) → 中文标题和摘要"""
+
+    def __init__(self, path: str, model: str, max_entries: int = 200000, max_age_days: int = 180):
+        self.model = model
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                doi TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                title_cn TEXT NOT NULL,
+                abstract_cn TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (doi, content_hash, model)
+            )
+        """)
+        self.evict(max_entries, max_age_days)
+
+    @staticmethod
+    def content_hash(article: Dict) -> str:
+        text = f"{article.get('title', '')}\n{article.get('abstract', '')}"
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+    def evict(self, max_entries: int, max_age_days: int):
+        """删除过期条目，并按写入时间只保留最新的 max_entries 条"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM translations WHERE created_at < ?",
+                               (time.time() - max_age_days * 86400,))
+            self._conn.execute("""
+                DELETE FROM translations WHERE rowid NOT IN (
+                    SELECT rowid FROM translations ORDER BY created_at DESC LIMIT ?
+                )
+            """, (max_entries,))
+
+    def get(self, article: Dict) -> Optional[Dict[str, str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title_cn, abstract_cn FROM translations WHERE doi = ? AND content_hash = ? AND model = ?",
+                (article_key(article), self.content_hash(article), self.model)
+            ).fetchone()
+            self.stats['hits' if row else 'misses'] += 1
+        if row:
+            return {'title_cn': row[0], 'abstract_cn': row[1]}
+        return None
+
+    def contains(self, article: Dict) -> bool:
+        """是否有这篇文章的缓存（不计入命中统计）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM translations WHERE doi = ? AND content_hash = ? AND model = ?",
+                (article_key(article), self.content_hash(article), self.model)
+            ).fetchone()
+        return row is not None
+
+    def put(self, article: Dict, translation: Dict[str, str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+                (article_key(article), self.content_hash(article), self.model,
+                 translation.get('title_cn', ''), translation.get('abstract_cn', ''), time.time())
+            )
+            self.stats['writes'] += 1
+
+    def lookup(self, articles: List[Dict]) -> tuple:
+        """返回 ({article_key: 翻译}, 未命中的文章列表)"""
+        results = {}
+        misses = []
+        for article in articles:
+            cached = self.get(article)
+            if cached:
+                results[article_key(article)] = cached
+            else:
+                misses.append(article)
+        return results, misses
+
+def get_translation_cache() -> TranslationCache:
+    """获取本地翻译缓存（首次调用时打开并清理过期条目）"""
+    global _translation_cache
+    with _client_lock:
+        if _translation_cache is None:
+            _translation_cache = TranslationCache(
+                state_path('translations.sqlite3'),
+                CLAUDE_MODEL,
+                max_entries=int(CONFIG.get('cache', {}).get('max_entries', 200000)),
+                max_age_days=int(CONFIG.get('cache', {}).get('max_age_days', 180))
+            )
+    return _translation_cache
+
+# ============== 断点续跑记录 ==============
+
+class RunCheckpoint:
+    """断点续跑记录（SQLite）：每个订阅已翻译/已写入的文章、已写入的小结和已完成的期刊"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS journals (
+                    subscription TEXT PRIMARY KEY,
+                    done INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS articles (
+                    subscription TEXT NOT NULL,
+                    article_key TEXT NOT NULL,
+                    written INTEGER NOT NULL DEFAULT 0,
+                    title_cn TEXT NOT NULL,
+                    abstract_cn TEXT NOT NULL,
+                    issue_entry TEXT NOT NULL,
+                    PRIMARY KEY (subscription, article_key)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS summaries (
+                    subscription TEXT NOT NULL,
+                    volume TEXT NOT NULL,
+                    issue TEXT NOT NULL,
+                    PRIMARY KEY (subscription, volume, issue)
+                )
+            """)
+
+    def reset(self):
+        """开始新的一次运行：清空上次的记录"""
+        with self._lock, self._conn:
+            for table in ('journals', 'articles', 'summaries'):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def is_done(self, subscription: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT done FROM journals WHERE subscription = ?",
+                                     (subscription,)).fetchone()
+        return bool(row and row[0])
+
+    def mark_done(self, subscription: str):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO journals VALUES (?, 1)", (subscription,))
+
+    def record_translations(self, subscription: str, articles: List[Dict], translations: Dict[str, Dict[str, str]]):
+        """记录已翻译的文章（尚未写入），续跑时不再调用Claude"""
+        rows = [
+            (subscription, article_key(a), translations[article_key(a)].get('title_cn', ''),
+             translations[article_key(a)].get('abstract_cn', ''), json.dumps(issue_entry(a), ensure_ascii=False))
+            for a in articles if article_key(a) in translations
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO articles VALUES (?, ?, 0, ?, ?, ?)", rows
+            )
+
+    def record_written(self, subscription: str, article: Dict, translation: Dict[str, str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, 1, ?, ?, ?)",
+                (subscription, article_key(article), translation.get('title_cn', ''),
+                 translation.get('abstract_cn', ''), json.dumps(issue_entry(article), ensure_ascii=False))
+            )
+
+    def translations(self, subscription: str, articles: List[Dict]) -> tuple:
+        """返回 ({article_key: 翻译}, 没有记录的文章列表)"""
+        with self._lock:
+            rows = dict(
+                (row[0], {'title_cn': row[1], 'abstract_cn': row[2]})
+                for row in self._conn.execute(
+                    "SELECT article_key, title_cn, abstract_cn FROM articles WHERE subscription = ?",
+                    (subscription,)
+                )
+            )
+        results = {article_key(a): rows[article_key(a)] for a in articles if article_key(a) in rows}
+        misses = [a for a in articles if article_key(a) not in rows]
+        return results, misses
+
+    def translated_keys(self, subscription: str) -> set:
+        """已记录译文的文章 article_key"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT article_key FROM articles WHERE subscription = ?", (subscription,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def written(self, subscription: str) -> Dict[str, Dict]:
+        """上次运行已写入的文章：{article_key: 分组用的文章信息}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT article_key, issue_entry FROM articles WHERE subscription = ? AND written = 1",
+                (subscription,)
+            ).fetchall()
+        return {key: json.loads(entry) for key, entry in rows}
+
+    def summary_done(self, subscription: str, volume: str, issue: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM summaries WHERE subscription = ? AND volume = ? AND issue = ?",
+                (subscription, volume, issue)
+            ).fetchone()
+        return row is not None
+
+    def record_summary(self, subscription: str, volume: str, issue: str):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO summaries VALUES (?, ?, ?)", (subscription, volume, issue))
+
+def get_run_checkpoint() -> RunCheckpoint:
+    """获取断点续跑记录（首次调用时打开）"""
+    global _run_checkpoint
+    with _client_lock:
+        if _run_checkpoint is None:
+            _run_checkpoint = RunCheckpoint(state_path('checkpoint.sqlite3'))
+    return _run_checkpoint
+
+# ============== 期刊小结状态 ==============
+
+class IssueState:
+    """每一期的本地状态（SQLite）：抓到过的文章、上次生成小结时的文章集合指纹和小结页面id
+
+    跨运行保留。重叠的抓取窗口再次抓到同一期时，文章集合没有变化就不再生成小结；
+    有新文章时把这一期标记为待更新，用这一期的全部文章重新生成，并原地更新已有的小结页面。
+    超过 max_age_days 天没有再抓到的期连同文章一起删除。
+    """
+
+    def __init__(self, path: str, max_age_days: int = 180):
+        # 状态文件是这次新建的（首次运行、状态缓存丢失或分片数变化）：小结库中可能已有本地不知道的页面
+        self.fresh = not os.path.exists(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS issue_articles (
+                    journal TEXT NOT NULL,
+                    volume TEXT NOT NULL,
+                    issue TEXT NOT NULL,
+                    article_key TEXT NOT NULL,
+                    entry TEXT NOT NULL,
+                    PRIMARY KEY (journal, volume, issue, article_key)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS issues (
+                    journal TEXT NOT NULL,
+                    volume TEXT NOT NULL,
+                    issue TEXT NOT NULL,
+                    fingerprint TEXT,
+                    page_id TEXT,
+                    stale INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (journal, volume, issue)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS issues_stale ON issues (journal, stale)")
+        self.evict(max_age_days)
+
+    def evict(self, max_age_days: int):
+        """删除超过 max_age_days 天没有抓到新文章、也没有写入小结的期"""
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock, self._conn:
+            self._conn.execute("""
+                DELETE FROM issue_articles WHERE EXISTS (
+                    SELECT 1 FROM issues i WHERE i.journal = issue_articles.journal AND i.volume = issue_articles.volume
+                    AND i.issue = issue_articles.issue AND i.updated_at < ?
+                )
+            """, (cutoff,))
+            self._conn.execute("DELETE FROM issues WHERE updated_at < ?", (cutoff,))
+
+    @staticmethod
+    def fingerprint(keys: Iterable[str]) -> str:
+        """文章集合的指纹（与顺序无关）"""
+        return hashlib.sha256('\n'.join(sorted(keys)).encode('utf-8')).hexdigest()[:32]
+
+    def add_articles(self, journal: str, volume: str, issue: str, entries: List[Dict]):
+        """记录这一期抓到的文章；有以前没抓到过的文章时把这一期标记为待更新"""
+        rows = [(journal, str(volume), str(issue), article_key(entry), json.dumps(entry, ensure_ascii=False))
+                for entry in entries]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            known = {row[0] for row in self._conn.execute(
+                "SELECT article_key FROM issue_articles WHERE journal = ? AND volume = ? AND issue = ?",
+                (journal, str(volume), str(issue))
+            )}
+            stale = int(any(row[3] not in known for row in rows))
+            self._conn.executemany("INSERT OR REPLACE INTO issue_articles VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO issues (journal, volume, issue, updated_at) VALUES (?, ?, ?, ?)",
+                (journal, str(volume), str(issue), time.time())
+            )
+            self._conn.execute(
+                "UPDATE issues SET stale = MAX(stale, ?), updated_at = ? WHERE journal = ? AND volume = ? AND issue = ?",
+                (stale, time.time(), journal, str(volume), str(issue))
+            )
+
+    def articles(self, journal: str, volume: str, issue: str) -> List[Dict]:
+        """这一期抓到过的全部文章（分组用的文章信息）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry FROM issue_articles WHERE journal = ? AND volume = ? AND issue = ? ORDER BY rowid",
+                (journal, str(volume), str(issue))
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _get(self, column: str, journal: str, volume: str, issue: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {column} FROM issues WHERE journal = ? AND volume = ? AND issue = ?",
+                (journal, str(volume), str(issue))
+            ).fetchone()
+        return row[0] if row else None
+
+    def summary_fingerprint(self, journal: str, volume: str, issue: str) -> Optional[str]:
+        return self._get('fingerprint', journal, volume, issue)
+
+    def stale_issues(self, journal: str) -> List[tuple]:
+        """期刊中有新文章但还没写入小结的期（上次生成或写入小结失败）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT volume, issue FROM issues WHERE journal = ? AND stale = 1", (journal,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def page_id(self, journal: str, volume: str, issue: str) -> Optional[str]:
+        return self._get('page_id', journal, volume, issue)
+
+    def page_unknown(self, journal: str, volume: str, issue: str) -> bool:
+        """本地状态不能确定这一期在小结库中有没有页面：状态文件是新建的、没有这一期的记录，
+        或者写过小结但页面记录已清除（上次更新失败）"""
+        if self.fresh:
+            return True
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, page_id FROM issues WHERE journal = ? AND volume = ? AND issue = ?",
+                (journal, str(volume), str(issue))
+            ).fetchone()
+        return row is None or (row[1] is None and row[0] is not None)
+
+    def _set(self, column: str, value: Optional[str], journal: str, volume: str, issue: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO issues (journal, volume, issue, updated_at) VALUES (?, ?, ?, ?)",
+                (journal, str(volume), str(issue), time.time())
+            )
+            self._conn.execute(
+                f"UPDATE issues SET {column} = ?, updated_at = ? WHERE journal = ? AND volume = ? AND issue = ?",
+                (value, time.time(), journal, str(volume), str(issue))
+            )
+
+    def record_summary(self, journal: str, volume: str, issue: str, fingerprint: str):
+        """小结已写入所有输出目标；写入的是当前的文章集合时清除待更新标记"""
+        self._set('fingerprint', fingerprint, journal, volume, issue)
+        with self._lock, self._conn:
+            keys = [row[0] for row in self._conn.execute(
+                "SELECT article_key FROM issue_articles WHERE journal = ? AND volume = ? AND issue = ?",
+                (journal, str(volume), str(issue))
+            )]
+            if self.fingerprint(keys) == fingerprint:
+                self._conn.execute("UPDATE issues SET stale = 0 WHERE journal = ? AND volume = ? AND issue = ?",
+                                   (journal, str(volume), str(issue)))
+
+    def record_page(self, journal: str, volume: str, issue: str, page_id: Optional[str]):
+        self._set('page_id', page_id, journal, volume, issue)
+
+def get_issue_state() -> IssueState:
+    """获取期刊小结状态（首次调用时打开）"""
+    global _issue_state
+    with _client_lock:
+        if _issue_state is None:
+            _issue_state = IssueState(
+                state_path('issues.sqlite3'),
+                max_age_days=int(CONFIG.get('cache', {}).get('issue_max_age_days', 180))
+            )
+    return _issue_state
+
+# ============== 订阅快照 ==============
+
+class SubscriptionSnapshot:
+    """订阅库的本地快照（SQLite）：按 page_id 保存订阅和它的 last_edited_time，以及下次增量读取的起点
+
+    每次运行都会给处理过的订阅写入"最近处理日期"，这些写入本身会改变 last_edited_time。
+    写入的响应直接记入快照（连同写入后的 last_edited_time）：下次增量读取到这些行时逐行比较，
+    last_edited_time 与记录的写入时间相同的是运行自己的写入，不算修改；写入之后又被手动修改的行照常读到。
+    """
+
+    def __init__(self, path: str, refresh_days: float = SUBSCRIPTION_REFRESH_DAYS):
+        self.refresh_days = refresh_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    page_id TEXT PRIMARY KEY,
+                    last_edited_time TEXT NOT NULL,
+                    enabled INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _meta(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+
+    def watermark(self, database_id: str) -> Optional[str]:
+        """增量读取的起点；没有快照、订阅库变更或到了全量读取的时间时返回None"""
+        meta = self._meta()
+        if self.refresh_days <= 0 or meta.get('database') != database_id or not meta.get('watermark'):
+            return None
+        if time.time() - float(meta.get('refreshed_at', 0)) > self.refresh_days * 86400:
+            return None
+        return meta['watermark']
+
+    @staticmethod
+    def delta_filter(since: str) -> Dict:
+        """增量读取的查询条件：since 之后修改过的行（包括上次运行自己写入的行，由 merge 逐行区分）"""
+        return {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": since}}
+
+    def merge(self, database_id: str, subscriptions: List[Dict], watermark: str, full: bool = False) -> int:
+        """合并读取到的订阅，返回与快照相比有修改的行数；full 时先清空快照（已删除的订阅随之移除）
+
+        last_edited_time 与快照中记录的相同（例如运行自己写入后记下的时间）的行不算修改。
+        """
+        rows = [(sub['page_id'], sub.get('last_edited_time', ''), int(sub['是否启用订阅']),
+                 json.dumps(sub, ensure_ascii=False)) for sub in subscriptions]
+        meta = [('database', database_id), ('watermark', watermark)]
+        if full:
+            meta.append(('refreshed_at', str(time.time())))
+        with self._lock, self._conn:
+            known = dict(self._conn.execute("SELECT page_id, last_edited_time FROM subscriptions").fetchall())
+            changed = sum(1 for row in rows if known.get(row[0]) != row[1])
+            if full:
+                self._conn.execute("DELETE FROM subscriptions")
+            self._conn.executemany("INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta)
+        return changed
+
+    def enabled(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM subscriptions WHERE enabled = 1 ORDER BY rowid").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _get(self, page_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM subscriptions WHERE page_id = ?", (page_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def unchanged(self, page_id: str, values: Dict) -> bool:
+        """快照中这一行的这些字段是否已经是给定的值"""
+        sub = self._get(page_id)
+        return sub is not None and all(sub.get(key) == value for key, value in values.items())
+
+    def record_write(self, sub: Dict):
+        """本次运行写入订阅库后，用写入响应中的整行（含写入后的 last_edited_time）更新快照"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?, ?)",
+                               (sub['page_id'], sub.get('last_edited_time', ''), int(sub['是否启用订阅']),
+                                json.dumps(sub, ensure_ascii=False)))
+
+    def remove(self, page_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM subscriptions WHERE page_id = ?", (page_id,))
+
+def get_subscription_snapshot() -> SubscriptionSnapshot:
+    """获取订阅快照（首次调用时打开）"""
+    global _subscription_snapshot
+    with _client_lock:
+        if _subscription_snapshot is None:
+            _subscription_snapshot = SubscriptionSnapshot(state_path('subscriptions.sqlite3'))
+    return _subscription_snapshot
+
+# ============== 发件箱 ==============
+
+class Outbox:
+    """本地发件箱（SQLite）：翻译好的文章和生成的小结先落盘，写入所有输出目标后才删除"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    subscription TEXT NOT NULL,
+                    item_key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    delivered TEXT NOT NULL DEFAULT '[]',
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    UNIQUE (kind, subscription, item_key)
+                )
+            """)
+
+    def put(self, kind: str, subscription: str, item_key: str, payload: Dict) -> int:
+        """加入一个条目并返回其id；同一条目已在发件箱中时返回已有的id"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (kind, subscription, item_key, payload, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (kind, subscription, item_key, json.dumps(payload, ensure_ascii=False, default=str), time.time())
+            )
+            return self._conn.execute(
+                "SELECT id FROM outbox WHERE kind = ? AND subscription = ? AND item_key = ?",
+                (kind, subscription, item_key)
+            ).fetchone()[0]
+
+    def get(self, item_id: int) -> Optional[tuple]:
+        """返回 (kind, subscription, payload, 已写入的输出目标集合)，条目不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT kind, subscription, payload, delivered FROM outbox WHERE id = ?",
+                                     (item_id,)).fetchone()
+        if row:
+            return row[0], row[1], json.loads(row[2]), set(json.loads(row[3]))
+        return None
+
+    def delivered(self, item_id: int, sinks: Iterable[str]):
+        """记录条目已写入的输出目标，重试时只写入其余目标"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE outbox SET delivered = ? WHERE id = ?",
+                               (json.dumps(sorted(sinks)), item_id))
+
+    def pending(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM outbox ORDER BY id")]
+
+    def done(self, item_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (item_id,))
+
+    def failed(self, item_id: int, error: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                               (error[:500], item_id))
+
+class JournalTicket:
+    """一个期刊在发件箱中的条目；期刊不再产生新条目且全部条目写入（或放弃）后调用 on_complete"""
+
+    def __init__(self, journal_data: Dict, window: Optional[Dict], on_complete):
+        self.journal_data = journal_data
+        self.window = window
+        self.article_count = 0
+        self.previously_written = 0
+        self.deferred = None
+        self.untranslated = 0
+        self.translation_failed = 0
+        self.fetch_error = None
+        self.written = {'article': 0, 'summary': 0}
+        self._on_complete = on_complete
+        self._pending = set()
+        self._closed = False
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def track(self, item_id: int):
+        with self._lock:
+            self._pending.add(item_id)
+
+    def settle(self, item_id: int, kind: str, ok: bool):
+        with self._lock:
+            self._pending.discard(item_id)
+            if ok:
+                self.written[kind] += 1
+        self._maybe_finish()
+
+    def close(self):
+        """期刊不会再产生新条目"""
+        with self._lock:
+            self._closed = True
+        self._maybe_finish()
+
+    def _maybe_finish(self):
+        with self._lock:
+            if self._finished or not self._closed or self._pending:
+                return
+            self._finished = True
+        self._on_complete(self)
+
+class OutboxWriter:
+    """发件箱写入阶段：后台线程把条目写入各输出目标（Notion 的限流由Notion客户端负责），失败时退避重试
+
+    每个条目记录已写入的输出目标，重试时只写入失败的目标。一次运行中尝试 OUTBOX_MAX_ATTEMPTS 次
+    仍失败的条目留在发件箱中，下次运行开始时先写入。
+    """
+
+    def __init__(self, outbox: Outbox, workers: int = OUTBOX_WRITERS, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff_base: float = 2.0, backoff_max: float = 60.0):
+        self.outbox = outbox
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {'written': 0, 'retries': 0, 'given_up': 0}
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._waiters = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动写入线程，并把上次运行留下的条目排在最前面"""
+        leftovers = self.outbox.pending()
+        if leftovers:
+            print(f"发件箱中有上次运行未写入的 {len(leftovers)} 个条目，先行写入")
+        for item_id in leftovers:
+            self._enqueue(item_id)
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def _enqueue(self, item_id: int):
+        with self._lock:
+            if item_id in self._queued:
+                return
+            self._queued.add(item_id)
+        self._queue.put(item_id)
+
+    def open_journal(self, journal_data: Dict, window: Optional[Dict] = None, on_complete=None) -> JournalTicket:
+        return JournalTicket(journal_data, window, on_complete or finish_journal)
+
+    def put(self, ticket: JournalTicket, kind: str, item_key: str, payload: Dict):
+        """加入一个条目，写入结果计入 ticket"""
+        item_id = self.outbox.put(kind, ticket.journal_data['page_id'], item_key, payload)
+        ticket.track(item_id)
+        with self._lock:
+            self._waiters.setdefault(item_id, []).append(ticket)
+        self._enqueue(item_id)
+
+    def drain(self):
+        """等待已排队的条目全部写入或放弃"""
+        self._queue.join()
+
+    def stop(self):
+        self.drain()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            item_id = self._queue.get()
+            if item_id is None:
+                self._queue.task_done()
+                return
+            # 单个条目出错（发件箱读写、完成回调）只影响这个条目，写入线程继续处理后面的条目
+            try:
+                try:
+                    kind, ok = self._write(item_id)
+                except Exception as e:
+                    print(f"  发件箱条目 {item_id} 写入出错，留在发件箱下次运行重试: {e}")
+                    kind, ok = None, False
+                try:
+                    self._settle(item_id, kind, ok)
+                except Exception as e:
+                    print(f"  更新发件箱条目 {item_id} 的期刊状态出错: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, item_id: int) -> tuple:
+        """写入一个条目，返回 (记录类型, 是否全部写入成功)"""
+        item = self.outbox.get(item_id)
+        ok = False
+        kind = item[0] if item else 'article'
+        for attempt in range(self.max_attempts):
+            if item is None:
+                break
+            kind, subscription, payload, delivered = item
+            errors = []
+            for sink in get_sinks():
+                if not sink.accepts(kind) or sink.name in delivered:
+                    continue
+                try:
+                    if sink.write(kind, payload):
+                        delivered.add(sink.name)
+                        self.outbox.delivered(item_id, delivered)
+                    else:
+                        errors.append(f"{sink.name}: 写入失败")
+                except Exception as e:
+                    errors.append(f"{sink.name}: {e}")
+            ok = not errors
+            if ok:
+                break
+            self.outbox.failed(item_id, '; '.join(errors))
+            if attempt + 1 < self.max_attempts:
+                with self._lock:
+                    self.stats['retries'] += 1
+                metrics.inc('paperalert_retries_total', service='outbox')
+                time.sleep(min(self.backoff_base * 2 ** attempt, self.backoff_max) * (0.5 + random.random() / 2))
+
+        if ok:
+            self.outbox.done(item_id)
+            with self._lock:
+                self.stats['written'] += 1
+            self._record_written(kind, item[1], item[2])
+        elif item is not None:
+            with self._lock:
+                self.stats['given_up'] += 1
+            label = item[2].get('title') or f"{item[2].get('journal', '')} 小结"
+            print(f"  写入失败，留在发件箱下次运行重试: {label[:50]}")
+        metrics.inc('paperalert_outbox_writes_total', kind=kind, result='ok' if ok else 'deferred')
+        return kind, ok
+
+    def _settle(self, item_id: int, kind: Optional[str], ok: bool):
+        """条目处理结束：通知等待它的期刊"""
+        with self._lock:
+            self._queued.discard(item_id)
+            waiters = self._waiters.pop(item_id, [])
+        for ticket in waiters:
+            ticket.settle(item_id, kind, ok)
+
+    @staticmethod
+    def _record_written(kind: str, subscription: str, payload: Dict):
+        """写入成功后更新断点记录和DOI索引；小结写入所有输出目标后才记录文章集合指纹"""
+        if kind == 'article':
+            get_run_checkpoint().record_written(subscription, payload, payload)
+            doi_index.add(payload.get('doi', ''))
+        else:
+            get_run_checkpoint().record_summary(subscription, payload.get('volume', ''), payload.get('issue', ''))
+            if payload.get('fingerprint'):
+                get_issue_state().record_summary(payload['journal'], payload.get('volume', ''),
+                                                 payload.get('issue', ''), payload['fingerprint'])
+
+def get_outbox_writer() -> OutboxWriter:
+    """获取发件箱写入阶段（首次调用或上次已停止时打开发件箱并启动写入线程）"""
+    global _outbox_writer
+    with _client_lock:
+        if _outbox_writer is None or not _outbox_writer.running:
+            outbox = _outbox_writer.outbox if _outbox_writer else Outbox(state_path('outbox.sqlite3'))
+            _outbox_writer = OutboxWriter(outbox)
+            _outbox_writer.start()
+    return _outbox_writer
+
 # ============== Claude API 函数 ==============
-# (保持之前的实现不变)
 
-def translate_and_extract(title: str, abstract: str) -> Dict[str, str]:
-    """使用Claude翻译标题和摘要（简化版，节省token）"""
-    if not abstract:
-        # 只翻译标题
-        prompt = f"""请将以下英文标题翻译成中文：
+class ClaudeUnavailable(Exception):
+    """Claude 持续限流或过载，重试用尽"""
+
+class AdaptiveConcurrency:
+    """Claude 请求的自适应并发上限（AIMD）
+
+    请求成功且延迟不超过目标时，上限每轮（约 limit 个请求）加 1；延迟超过目标或出现 5xx 时乘 0.9；
+    收到 429/529 时上限减半，并在 retry-after 期间暂停发放。同一轮限流（减半之前发出的请求）只减一次。
+    """
+
+    def __init__(self, max_limit: int, initial: int = 2, min_limit: int = 1, latency_target: float = 60.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(min(initial, max_limit))
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.stats = {'peak': 0, 'throttled': 0, 'throttled_seconds': 0.0, 'retries': 0}
+        self._paused_until = 0.0
+        self._last_cut = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> float:
+        """等待一个并发名额，返回请求开始的时间"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+            self.stats['peak'] = max(self.stats['peak'], self.in_flight)
+            return now
+
+    def release(self, started: float, outcome: str = 'ok', delay: float = 0.0):
+        """归还名额并按结果调整上限；outcome 为 ok / error / throttled / ignored"""
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == 'throttled':
+                self.stats['throttled'] += 1
+                if started >= self._last_cut:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_cut = now
+                if now + delay > self._paused_until:
+                    self.stats['throttled_seconds'] += now + delay - max(now, self._paused_until)
+                    self._paused_until = now + delay
+            elif outcome == 'error' or (outcome == 'ok' and now - started > self.latency_target):
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            elif outcome == 'ok':
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            metrics.set('paperalert_claude_concurrency_limit', self.limit)
+            self._cond.notify_all()
+
+claude_concurrency = AdaptiveConcurrency(CLAUDE_MAX_CONCURRENCY, CLAUDE_INITIAL_CONCURRENCY,
+                                         latency_target=CLAUDE_LATENCY_TARGET)
+
+CLAUDE_THROTTLE_STATUS = {429, 529}
+CLAUDE_RETRY_STATUS = {500, 502, 503, 504}
+
+def claude_retry_after(error: Exception) -> Optional[float]:
+    """从错误响应的 retry-after-ms / retry-after 头中读取等待秒数"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return min(float(headers['retry-after-ms']) / 1000, 60.0)
+        if headers.get('retry-after'):
+            return min(float(headers['retry-after']), 60.0)
+    except ValueError:
+        pass
+    return None
+
+def record_claude_usage(stage: str, usage):
+    """记录一次响应的输入/输出token数，以及提示词缓存的写入/读取token数"""
+    if usage is None:
+        return
+    metrics.inc('paperalert_claude_tokens_total', usage.input_tokens, operation=stage, type='input')
+    metrics.inc('paperalert_claude_tokens_total', usage.output_tokens, operation=stage, type='output')
+    cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+    if cache_write:
+        metrics.inc('paperalert_claude_tokens_total', cache_write, operation=stage, type='cache_write')
+    if cache_read:
+        metrics.inc('paperalert_claude_tokens_total', cache_read, operation=stage, type='cache_read')
+
+def claude_create(stage: str, **params):
+    """调用 messages.create，并记录耗时和token数
+
+    请求经过自适应并发控制；429/529 按 retry-after 暂停后重试，5xx 和连接错误指数退避后重试，
+    重试用尽时抛出 ClaudeUnavailable。SDK 自带的重试关闭，限流信号全部交给并发控制。
+    """
+    import anthropic
+
+    client = get_claude_client().with_options(max_retries=0)
+    for attempt in range(CLAUDE_MAX_RETRIES + 1):
+        started = claude_concurrency.acquire()
+        try:
+            with metrics.timed('claude', operation=stage):
+                response = client.messages.create(**params)
+        except Exception as e:
+            status = getattr(e, 'status_code', None)
+            if status in CLAUDE_THROTTLE_STATUS:
+                delay = claude_retry_after(e) or min(2 ** attempt, 60)
+                claude_concurrency.release(started, 'throttled', delay)
+                metrics.inc('paperalert_claude_throttled_total', status=str(status))
+            elif status in CLAUDE_RETRY_STATUS or isinstance(e, anthropic.APIConnectionError):
+                delay = random.uniform(0, min(2 ** attempt, 60))
+                claude_concurrency.release(started, 'error')
+            else:
+                claude_concurrency.release(started, 'ignored')
+                raise
+            if attempt == CLAUDE_MAX_RETRIES:
+                raise ClaudeUnavailable(f"重试 {CLAUDE_MAX_RETRIES} 次后仍失败: {e}") from e
+            claude_concurrency.stats['retries'] += 1
+            metrics.inc('paperalert_retries_total', service='claude')
+            if status not in CLAUDE_THROTTLE_STATUS:
+                time.sleep(delay)
+            continue
+        claude_concurrency.release(started)
+        record_claude_usage(stage, getattr(response, 'usage', None))
+        return response
+
+# 固定的指令放在 system 中并标记为可缓存，用户消息只包含每篇文章不同的标题和摘要。
+# 缓存按前缀匹配：所有翻译请求共用第一段（翻译要求），第二段按任务区分。
+TRANSLATION_GUIDELINES = """你是学术文献翻译助手，负责把英文期刊文章的标题和摘要翻译成中文。
+
+要求：
+1. 翻译准确、符合学术规范"""
+
+TITLE_TRANSLATION_TASK = """用户消息给出一篇文章的英文标题（"标题：..."）。
+
+直接输出中文标题，不要其他内容。"""
+
+ARTICLE_TRANSLATION_TASK = """用户消息给出一篇文章的英文标题和摘要（"标题：..."、"摘要：..."）。
+
+请按以下JSON格式输出：
+{
+  "title_cn": "中文标题",
+  "abstract_cn": "中文摘要"
+}
+
+只输出JSON，不要其他内容。"""
+
+BATCH_TRANSLATION_TASK = """用户消息是文章列表（JSON数组，每项包含 doi、title、abstract）。
+
+请按以下JSON数组格式输出，每篇文章一项，doi 原样保留：
+[
+  {"doi": "原文doi", "title_cn": "中文标题", "abstract_cn": "中文摘要"}
+]
 
-标题：{title}
+摘要为空的文章，abstract_cn 输出空字符串。只输出JSON数组，不要其他内容。"""
+
+SUMMARY_INSTRUCTIONS = """你负责为学术期刊的一期撰写中文小结（150-200字），内容包括：
+
+1. 本期文章的主要研究主题和方向
+2. 使用的主要研究方法
+3. 整体研究趋势或特点
 
 要求：
-1. 翻译准确、符合学术规范
-2. 直接输出中文标题，不要其他内容"""
+- 简洁概括，突出重点
+- 客观中立"""
+
+ISSUE_SUMMARY_TASK = """用户消息给出本期文章列表。直接输出小结文本，不要前缀和标题。"""
+
+# 文章较多时先分组提炼要点（map），再把各组要点合并成小结（reduce）
+PARTIAL_SUMMARY_TASK = """用户消息给出本期的一部分文章。这一步还不写小结，只为这部分文章提炼要点：
+用 3-5 条中文要点列出研究主题、主要方法和值得注意的发现，每条不超过40字，
+注明每个主题大约涉及几篇文章。直接输出要点，不要前缀。"""
+
+REDUCE_SUMMARY_TASK = """用户消息给出本期文章数和各组文章的要点（每组由上一步单独提炼）。
+综合所有组的要点撰写整期的小结，按各主题涉及的文章数把握详略。直接输出小结文本，不要前缀和标题。"""
+
+def cached_system(*blocks: str) -> List[Dict]:
+    """构造带缓存标记的 system 参数，每段末尾都是一个缓存断点"""
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}} for text in blocks]
 
-        response = claude_client.messages.create(
+def request_translation(title: str, abstract: str) -> Dict[str, str]:
+    """使用Claude翻译单篇文章的标题和摘要，失败时抛出异常"""
+    if not abstract:
+        # 只翻译标题
+        response = claude_create(
+            'translate',
             model=CLAUDE_MODEL,
             max_tokens=500,
-            messages=[{"role": "user", "content": prompt}]
+            system=cached_system(TRANSLATION_GUIDELINES, TITLE_TRANSLATION_TASK),
+            messages=[{"role": "user", "content": f"标题：{title}"}]
         )
 
         title_cn = response.content[0].text.strip()
@@ -376,87 +2343,246 @@ def translate_and_extract(title: str, abstract: str) -> Dict[str, str]:
         }
 
     # 只翻译标题和摘要，不提取动机和方法
-    prompt = f"""请将以下学术文章的标题和摘要翻译成中文：
+    response = claude_create(
+        'translate',
+        model=CLAUDE_MODEL,
+        max_tokens=1500,
+        system=cached_system(TRANSLATION_GUIDELINES, ARTICLE_TRANSLATION_TASK),
+        messages=[{"role": "user", "content": f"标题：{title}\n\n摘要：{abstract}"}]
+    )
+
+    result = json.loads(strip_code_fence(response.content[0].text))
+    return result
+
+def strip_code_fence(text: str) -> str:
+    """去掉模型输出外层的 ```json 代码块标记"""
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.split('```')[1]
+        if text.startswith('json'):
+            text = text[4:]
+    return text.strip()
+
+def article_key(article: Dict) -> str:
+    """文章的唯一标识（优先使用DOI）"""
+    return article.get('doi') or article.get('url') or article.get('title', '')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计英文文本的token数（约4字符/token）"""
+    return len(text or '') // 4 + 1
+
+def iter_translation_batches(articles: Iterable[Dict], token_budget: int = TRANSLATION_BATCH_TOKENS,
+                             max_items: int = TRANSLATION_BATCH_SIZE,
+                             estimate: Optional[Callable[[Dict], int]] = None) -> Iterator[List[Dict]]:
+    """把文章流按输入token预算和条数上限分成批次；estimate 估算一篇文章的输入token（默认按完整的标题和摘要）"""
+    batch = []
+    batch_tokens = 0
+    for article in articles:
+        if estimate:
+            cost = estimate(article)
+        else:
+            cost = estimate_tokens(article.get('title', '')) + estimate_tokens(article.get('abstract', ''))
+        if batch and (batch_tokens + cost > token_budget or len(batch) >= max_items):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(article)
+        batch_tokens += cost
+    if batch:
+        yield batch
+
+def build_batch_translation_request(articles: List[Dict]) -> Dict:
+    """构造批量翻译请求参数（messages.create 的关键字参数）"""
+    items = [
+        {'doi': article_key(a), 'title': a.get('title', ''), 'abstract': a.get('abstract', '')}
+        for a in articles
+    ]
+    input_tokens = sum(estimate_tokens(i['title']) + estimate_tokens(i['abstract']) for i in items)
+
+    return {
+        'model': CLAUDE_MODEL,
+        # 中文译文的token数通常不超过英文原文的2倍
+        'max_tokens': min(input_tokens * 2 + 100 * len(items), 16000),
+        'system': cached_system(TRANSLATION_GUIDELINES, BATCH_TRANSLATION_TASK),
+        'messages': [{"role": "user", "content": json.dumps(items, ensure_ascii=False)}]
+    }
 
-标题：{title}
+def parse_batch_translation(text: str, articles: List[Dict]) -> Dict[str, Dict[str, str]]:
+    """解析批量翻译结果，只返回格式合法的条目"""
+    parsed = json.loads(strip_code_fence(text))
+    if not isinstance(parsed, list):
+        raise ValueError("批量翻译结果不是JSON数组")
 
-摘要：{abstract}
+    expected = {article_key(a): a for a in articles}
+    results = {}
+    for entry in parsed:
+        if not isinstance(entry, dict) or entry.get('doi') not in expected:
+            continue
+        title_cn = entry.get('title_cn')
+        abstract_cn = entry.get('abstract_cn', '')
+        if not isinstance(title_cn, str) or not title_cn.strip() or not isinstance(abstract_cn, str):
+            continue
+        if expected[entry['doi']].get('abstract') and not abstract_cn.strip():
+            continue
+        results[entry['doi']] = {'title_cn': title_cn.strip(), 'abstract_cn': abstract_cn.strip()}
+    return results
 
-请按以下JSON格式输出：
-{{
-  "title_cn": "中文标题",
-  "abstract_cn": "中文摘要"
-}}
+def request_batch_translation(articles: List[Dict]) -> Dict[str, Dict[str, str]]:
+    """发送一次批量翻译请求，只返回格式合法的条目"""
+    response = claude_create('translate_batch', **build_batch_translation_request(articles))
+    return parse_batch_translation(response.content[0].text, articles)
 
-要求：
-1. 翻译准确、符合学术规范
-2. 只输出JSON，不要其他内容"""
+def claude_unavailable(error: Exception) -> bool:
+    """Claude 请求本身失败（限流或过载重试用尽、API 返回错误状态、连接失败）
 
-    try:
-        response = claude_client.messages.create(
-            model=CLAUDE_MODEL,
-            max_tokens=1500,
-            messages=[{"role": "user", "content": prompt}]
-        )
+    这类失败与文章内容无关（例如模型名错误、余额不足），换一批请求也不会成功，文章应推迟而不是以英文原文写入；
+    其余异常是请求成功后解析或校验输出失败
+    """
+    import anthropic
 
-        result_text = response.content[0].text.strip()
-        if result_text.startswith('```'):
-            result_text = result_text.split('```')[1]
-            if result_text.startswith('json'):
-                result_text = result_text[4:]
+    return isinstance(error, (ClaudeUnavailable, anthropic.APIError))
 
-        result = json.loads(result_text)
-        return result
+def translate_batch(articles: List[Dict], failures: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, str]]:
+    """批量翻译多篇文章，返回 {article_key: {'title_cn', 'abstract_cn'}}
 
+    模型输出不完整或格式错误时，把失败的条目拆分后重试，直到单篇请求。成功的翻译会写入翻译缓存。
+    失败的文章不在结果中，原因记入 failures：'unavailable'（Claude 请求失败）或 'error'（单篇请求的输出仍无法解析）。
+    """
+    failures = {} if failures is None else failures
+    if len(articles) == 1:
+        article = articles[0]
+        try:
+            result = request_translation(article['title'], article['abstract'])
+        except Exception as e:
+            print(f"Claude API调用失败: {e}")
+            failures[article_key(article)] = 'unavailable' if claude_unavailable(e) else 'error'
+            return {}
+        get_translation_cache().put(article, result)
+        return {article_key(article): result}
+
+    try:
+        results = request_batch_translation(articles)
     except Exception as e:
-        print(f"Claude API调用失败: {e}")
-        return {
-            'title_cn': title,
-            'abstract_cn': abstract
-        }
+        print(f"    批量翻译失败（{len(articles)}篇）: {e}")
+        if claude_unavailable(e):
+            # 限流时拆分只会增加请求数
+            failures.update((article_key(article), 'unavailable') for article in articles)
+            return {}
+        results = {}
 
-def generate_issue_summary(articles: List[Dict]) -> str:
-    """生成某一期的小结"""
-    if len(articles) > 10:
-        articles = articles[:10]
-    
+    for article in articles:
+        if article_key(article) in results:
+            get_translation_cache().put(article, results[article_key(article)])
+
+    failed = [a for a in articles if article_key(a) not in results]
+    if not failed:
+        return results
+
+    if len(failed) < len(articles):
+        results.update(translate_batch(failed, failures))
+    else:
+        middle = len(failed) // 2
+        results.update(translate_batch(failed[:middle], failures))
+        results.update(translate_batch(failed[middle:], failures))
+    return results
+
+def translate_articles(articles: List[Dict], failures: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, str]]:
+    """翻译一批文章：先查翻译缓存，只把未命中的文章交给 translate_batch"""
+    results, misses = get_translation_cache().lookup(articles)
+    if misses:
+        results.update(translate_batch(misses, failures))
+    return results
+
+def format_summary_articles(articles: List[Dict], start: int = 1) -> str:
+    """小结请求中的文章列表（过长的摘要截断到 SUMMARY_ABSTRACT_CHARS 个字符）"""
     articles_text = ""
-    for i, article in enumerate(articles, 1):
+    for i, article in enumerate(articles, start):
         articles_text += f"\n{i}. {article.get('title', '')}\n"
-        if article.get('abstract'):
-            articles_text += f"   摘要：{article['abstract'][:200]}...\n"
-    
-    prompt = f"""请为这一期期刊撰写一份小结（150-200字），内容包括：
+        abstract = article.get('abstract', '')
+        if abstract:
+            if len(abstract) > SUMMARY_ABSTRACT_CHARS:
+                abstract = abstract[:SUMMARY_ABSTRACT_CHARS] + '...'
+            articles_text += f"   摘要：{abstract}\n"
+    return articles_text
+
+def summary_chunks(articles: List[Dict]) -> List[List[Dict]]:
+    """按输入token预算把一期的文章分组；只有一组时直接生成小结
+
+    按提示词中实际出现的文本（摘要截断到 SUMMARY_ABSTRACT_CHARS 个字符）估算，长摘要不会让一期被多分组。
+    """
+    return list(iter_translation_batches(articles, token_budget=SUMMARY_CHUNK_TOKENS, max_items=len(articles) or 1,
+                                         estimate=lambda article: estimate_tokens(format_summary_articles([article]))))
+
+def summary_params(task: str, content: str) -> Dict:
+    return {
+        'model': CLAUDE_MODEL,
+        'max_tokens': 500,
+        'system': cached_system(SUMMARY_INSTRUCTIONS, task),
+        'messages': [{"role": "user", "content": content}]
+    }
 
-1. 本期文章的主要研究主题和方向
-2. 使用的主要研究方法
-3. 整体研究趋势或特点
+def build_summary_request(articles: List[Dict]) -> Dict:
+    """构造期刊小结请求参数（messages.create 的关键字参数）"""
+    return summary_params(ISSUE_SUMMARY_TASK, f"本期文章列表：{format_summary_articles(articles)}")
 
-本期文章列表：{articles_text}
+def build_partial_summary_request(articles: List[Dict], start: int) -> Dict:
+    """构造一组文章的要点请求参数；start 为这一组第一篇文章在本期中的序号"""
+    return summary_params(PARTIAL_SUMMARY_TASK, f"本期部分文章：{format_summary_articles(articles, start)}")
 
-要求：
-- 简洁概括，突出重点
-- 客观中立
-- 直接输出小结文本，不要前缀和标题"""
-    
+def build_reduce_summary_request(article_count: int, partials: List[str]) -> Dict:
+    """构造合并各组要点的请求参数"""
+    groups = "\n\n".join(f"第{i}组要点：\n{partial}" for i, partial in enumerate(partials, 1))
+    return summary_params(REDUCE_SUMMARY_TASK, f"本期共{article_count}篇文章，分{len(partials)}组。\n\n{groups}")
+
+def generate_partial_summaries(chunks: List[List[Dict]]) -> Optional[List[str]]:
+    """并发生成各组文章的要点；任何一组失败时返回None（缺组的小结不能覆盖整期）"""
+    starts = [1]
+    for chunk in chunks[:-1]:
+        starts.append(starts[-1] + len(chunk))
+
+    def summarize(chunk: List[Dict], start: int) -> Optional[str]:
+        try:
+            response = claude_create('summary_map', **build_partial_summary_request(chunk, start))
+            return response.content[0].text.strip()
+        except Exception as e:
+            print(f"生成第 {start}-{start + len(chunk) - 1} 篇文章的要点失败: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(SUMMARY_WORKERS, len(chunks))) as executor:
+        partials = list(executor.map(summarize, chunks, starts))
+    if not all(partials):
+        return None
+    return partials
+
+def generate_issue_summary(articles: List[Dict]) -> Optional[str]:
+    """生成某一期的小结；文章较多时先并发生成各组要点，再合并成小结。失败时返回None，下次运行重试"""
     try:
-        response = claude_client.messages.create(
-            model=CLAUDE_MODEL,
-            max_tokens=500,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        chunks = summary_chunks(articles)
+        if len(chunks) <= 1:
+            response = claude_create('summary', **build_summary_request(articles))
+        else:
+            partials = generate_partial_summaries(chunks)
+            if partials is None:
+                raise RuntimeError("部分文章的要点生成失败")
+            response = claude_create('summary', **build_reduce_summary_request(len(articles), partials))
 
         return response.content[0].text.strip()
         
     except Exception as e:
         print(f"生成小结失败: {e}")
-        return f"本期共收录{len(articles)}篇文章。"
+        return None
 
 # ============== 数据清理函数 ==============
 
-def clean_old_articles(days: int = 30):
-    """清理超过指定天数的文章记录"""
+def clean_old_articles(days: int = ARTICLE_RETENTION_DAYS, time_budget: Optional[float] = None):
+    """清理超过指定天数的文章记录
+
+    按页流式读取并用有界线程池并发归档（共享Notion客户端的限流）。超过时间预算时停止，
+    已归档的页面不会再被查询到，下次运行自然从剩余部分继续。
+    """
     db_id = CONFIG['notion']['databases']['articles']
+    time_budget = CLEAN_TIME_BUDGET if time_budget is None else time_budget
+    deadline = time.monotonic() + time_budget if time_budget > 0 else None
 
     # 计算截止日期
     cutoff_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
@@ -471,35 +2597,375 @@ def clean_old_articles(days: int = 30):
         }
     }
 
-    old_articles = notion_query_database(db_id, filter_obj)
+    def archive(page_id: str) -> Optional[bool]:
+        if deadline and time.monotonic() > deadline:
+            return None
+        try:
+            return notion_archive_page(page_id)
+        except Exception as e:
+            print(f"  归档页面 {page_id[:8]} 失败: {e}")
+            return False
 
-    if not old_articles:
+    success_count = 0
+    failed_ids = set()
+    timed_out = False
+
+    with ThreadPoolExecutor(max_workers=CLEAN_WORKERS) as executor:
+        while not timed_out:
+            # 每轮重新从头查询：已归档的页面不再出现，避免边翻页边归档导致游标错乱
+            pending = (page['id'] for page in notion_query_database(db_id, filter_obj)
+                       if page['id'] not in failed_ids)
+            page_ids = list(islice(pending, NOTION_PAGE_SIZE))
+            if not page_ids:
+                break
+
+            for page_id, result in zip(page_ids, executor.map(archive, page_ids)):
+                if result:
+                    success_count += 1
+                elif result is None:
+                    timed_out = True
+                else:
+                    failed_ids.add(page_id)
+
+            print(f"  已归档 {success_count} 篇, 失败 {len(failed_ids)} 篇")
+
+    if timed_out:
+        print(f"  达到时间预算 {time_budget:g} 秒，剩余旧文章下次运行继续清理")
+    elif not success_count and not failed_ids:
         print("  没有需要清理的旧文章")
         return
 
-    print(f"  找到 {len(old_articles)} 篇旧文章需要清理")
+    print(f"  成功归档 {success_count} 篇文章")
+
+# ============== 运行预算调度 ==============
+
+def estimate_article_tokens(article: Dict) -> int:
+    """估算翻译一篇文章消耗的token数：输入为标题和摘要，中文译文按输入的2倍估算"""
+    input_tokens = estimate_tokens(article.get('title', '')) + estimate_tokens(article.get('abstract', ''))
+    return input_tokens * 3 + 50
+
+def translation_known(page_id: str) -> Callable[[Dict], bool]:
+    """返回判断文章是否已有译文（断点记录或翻译缓存）的函数，供 JournalAllowance.admit 跳过计费"""
+    recorded = get_run_checkpoint().translated_keys(page_id)
+    cache = get_translation_cache()
+    return lambda article: article_key(article) in recorded or cache.contains(article)
+
+class JournalAllowance:
+    """单个期刊在本次运行中分到的预算"""
+
+    def __init__(self, budget: 'RunBudget', quota: Optional[int]):
+        self.budget = budget
+        self.quota = quota
+        self.used = 0
+        self.deferred = None
+
+    def admit(self, articles: Iterable[Dict], translated: Optional[Callable[[Dict], bool]] = None) -> Iterator[Dict]:
+        """在预算内逐篇放行文章；超出期刊份额、总预算或时间预算时停止，并在 deferred 中记录原因
+
+        份额不足一篇文章时，只要总预算还够，仍放行第一篇，避免份额小的期刊一直没有进展；
+        translated 判断文章是否已有译文（断点记录或翻译缓存），已有译文的文章不调用Claude，不计费
+        """
+        iterator = iter(articles)
+        while True:
+            # 先检查时间，到期后不再向Crossref请求下一页
+            if self.budget.expired():
+                self.deferred = '时间预算'
+                return
+            article = next(iterator, None)
+            if article is None:
+                return
+            if translated and translated(article):
+                yield article
+                continue
+            cost = estimate_article_tokens(article)
+            if self.quota is not None and self.used and self.used + cost > self.quota or not self.budget.charge(cost):
+                self.deferred = 'token预算'
+                return
+            self.used += cost
+            yield article
+
+class RunBudget:
+    """整次运行的token和时间预算
+
+    期刊按"优先级"从高到低处理；每个期刊开始时按权重（优先级+1）分到剩余token预算的一份，
+    没用完的部分留给后面的期刊，份额不足一篇文章时每个期刊至少处理一篇。超出份额或预算的文章推迟到下次运行。
+    """
+
+    def __init__(self, token_budget: int = 0, time_budget: float = 0):
+        self.token_budget = token_budget
+        self.time_budget = time_budget
+        self.deadline = None
+        self.spent = 0
+        self.stats = {'deferred': 0}
+        self._weights = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def weight(journal_data: Dict) -> float:
+        return max(journal_data.get('优先级') or 0, 0) + 1
+
+    def begin(self):
+        """开始计时（时间预算从运行开始算起）"""
+        if self.time_budget:
+            self.deadline = time.monotonic() + self.time_budget
+
+    def plan(self, subscriptions: List[Dict]) -> List[Dict]:
+        """按优先级排序订阅（优先级相同保持原顺序），并登记各期刊的权重"""
+        ordered = sorted(subscriptions, key=lambda j: -(j.get('优先级') or 0))
+        with self._lock:
+            self._weights = {j['page_id']: self.weight(j) for j in ordered if subscription_issns(j)}
+        return ordered
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def allocate(self, page_id: str) -> JournalAllowance:
+        """期刊开始处理时分配份额：剩余预算 × 本期刊权重 / 尚未开始的期刊总权重"""
+        with self._lock:
+            total_weight = sum(self._weights.values())
+            weight = self._weights.pop(page_id, None)
+            if not self.token_budget or weight is None:
+                return JournalAllowance(self, None)
+            remaining = max(self.token_budget - self.spent, 0)
+            return JournalAllowance(self, int(remaining * weight / total_weight))
+
+    def charge(self, tokens: int) -> bool:
+        """从总预算中扣除；超出总预算时返回False"""
+        with self._lock:
+            if self.token_budget and self.spent + tokens > self.token_budget:
+                return False
+            self.spent += tokens
+            return True
+
+    def record_deferred(self):
+        with self._lock:
+            self.stats['deferred'] += 1
+
+run_budget = RunBudget(RUN_TOKEN_BUDGET, RUN_TIME_BUDGET)
+
+# ============== 并发处理 ==============
+
+class ThreadBufferedStdout:
+    """按线程缓冲的标准输出：并发处理期刊时每个期刊的日志整体输出，不互相穿插"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        with self._lock:
+            return self._stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    @contextmanager
+    def capture(self):
+        """在当前线程内缓冲输出，结束时一次性写出"""
+        self._local.buffer = io.StringIO()
+        try:
+            yield
+        finally:
+            output = self._local.buffer.getvalue()
+            self._local.buffer = None
+            with self._lock:
+                self._stream.write(output)
+                self._stream.flush()
+
+def process_journal_isolated(job: Dict):
+    """处理单个期刊任务（process_journal 的关键字参数），异常只记录到该期刊的订阅状态"""
+    journal_data = job['journal_data']
+    try:
+        process_journal(**job)
+    except Exception as e:
+        print(f"处理期刊失败: {e}")
+        update_subscription_status(journal_data['page_id'], journal_data['Journal'], f"失败：{e}")
 
-    success_count = 0
-    for page in old_articles:
-        page_id = page['id']
-        # 尝试获取文章标题用于日志
+def process_journals_concurrently(jobs: Iterable[Dict], workers: int):
+    """用有界线程池并发处理期刊任务，输出按期刊缓冲
+
+    任务按需从 jobs 中取出，在途任务最多为线程数的两倍：合并查询会在生成任务时抓取整组文章，
+    不能一开始就把所有组都抓进内存。
+    """
+    original_stdout = sys.stdout
+    stdout = ThreadBufferedStdout(original_stdout)
+    sys.stdout = stdout
+
+    def run(job: Dict):
+        with stdout.capture():
+            process_journal_isolated(job)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for job in jobs:
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(run, job))
+            for future in as_completed(pending):
+                future.result()
+    finally:
+        sys.stdout = original_stdout
+
+# ============== Message Batches 离线批处理 ==============
+
+def submit_message_batch(requests_params: Dict[str, Dict]) -> Dict[str, str]:
+    """提交一个 Message Batch 并轮询到结束，返回 {custom_id: 输出文本}（只含成功的请求）"""
+    client = get_claude_client()
+    try:
+        batch = client.messages.batches.create(requests=[
+            {'custom_id': custom_id, 'params': params}
+            for custom_id, params in requests_params.items()
+        ])
+    except Exception as e:
+        print(f"提交批处理失败: {e}，全部请求改为同步处理")
+        return {}
+    print(f"已提交批处理 {batch.id}（{len(requests_params)} 个请求），等待完成...")
+
+    outputs = {}
+    deadline = time.monotonic() + MESSAGE_BATCH_TIMEOUT_SECONDS
+    if run_budget.deadline is not None:
+        deadline = min(deadline, run_budget.deadline)
+    try:
+        while batch.processing_status != 'ended':
+            if time.monotonic() > deadline:
+                print(f"批处理 {batch.id} 超时未完成，已取消，剩余请求改为同步处理")
+                client.messages.batches.cancel(batch.id)
+                return {}
+            time.sleep(MESSAGE_BATCH_POLL_SECONDS)
+            batch = client.messages.batches.retrieve(batch.id)
+
+        for entry in client.messages.batches.results(batch.id):
+            if entry.result.type == 'succeeded':
+                outputs[entry.custom_id] = entry.result.message.content[0].text
+                record_claude_usage('message_batch', getattr(entry.result.message, 'usage', None))
+    except Exception as e:
+        print(f"查询批处理 {batch.id} 失败: {e}，剩余请求改为同步处理")
         try:
-            title = get_notion_title(page['properties'].get('Title', {}))
-            print(f"  归档: {title[:50]}...")
-        except:
-            print(f"  归档页面: {page_id[:8]}...")
+            client.messages.batches.cancel(batch.id)
+        except Exception:
+            pass
+        return outputs
+    print(f"批处理完成：成功 {len(outputs)}/{len(requests_params)} 个请求")
+    return outputs
+
+def process_journals_in_message_batch(subscriptions: List[Dict]):
+    """离线批处理模式：先抓取所有期刊，再把翻译和小结请求一次性提交，结果返回后再写入Notion"""
+    jobs = []
+    requests_params = {}
+
+    for index, fetch_job in enumerate(iter_journal_jobs(subscriptions)):
+        journal_data = fetch_job['journal_data']
+        journal_name = journal_data['Journal']
+        page_id = journal_data['page_id']
+        allowance = run_budget.allocate(page_id)
+        if RESUME_RUN and get_run_checkpoint().is_done(page_id):
+            print(f"\n跳过期刊: {journal_name}（上次运行已完成）")
+            continue
+        window = fetch_job.get('window') or get_fetch_window(journal_data)
+        if not window:
+            continue
+        issn = window['issn']
 
-        if notion_archive_page(page_id):
-            success_count += 1
+        print(f"\n抓取期刊: {journal_name} (ISSN: {issn})")
+        issue_groups = {}
+        written = restore_checkpoint(page_id, issue_groups)
+        try:
+            fetched = skip_written(iter_window_articles(window, fetch_job.get('articles')), written)
+            articles = list(allowance.admit(fetched, translation_known(page_id)))
+        except Exception as e:
+            print(f"  抓取ISSN {issn} 文章失败: {e}")
+            update_subscription_status(journal_data['page_id'], journal_name, "失败：抓取中断（已推送0篇）")
+            continue
+        print_keyword_stats(window)
 
-    print(f"  成功归档 {success_count}/{len(old_articles)} 篇文章")
+        if not articles and not written and not allowance.deferred:
+            print(f"  未找到新文章")
+            get_outbox_writer().open_journal(journal_data, window).close()
+            continue
+        print(f"  找到 {len(articles)} 篇文章")
+
+        for article in articles:
+            add_to_issue_group(issue_groups, article)
+
+        # 断点记录中已翻译或命中翻译缓存的文章不再提交
+        recorded, pending = get_run_checkpoint().translations(page_id, articles)
+        cached, misses = get_translation_cache().lookup(pending)
+        cached.update(recorded)
+
+        job = {'journal_data': journal_data, 'window': window, 'articles': articles, 'issue_groups': issue_groups,
+               'written_count': len(written), 'deferred': allowance.deferred, 'translations': cached, 'translation_ids': {}, 'summary_ids': {}}
+        for batch_index, batch in enumerate(iter_translation_batches(misses)):
+            custom_id = f"t-{index}-{batch_index}"
+            job['translation_ids'][custom_id] = batch
+            requests_params[custom_id] = build_batch_translation_request(batch)
+        for issue_index, (key, issue_articles) in enumerate(issue_groups.items()):
+            if key[0] and key[1] and not get_run_checkpoint().summary_done(page_id, *key):
+                planned = plan_issue_summary(journal_name, *key, issue_articles)
+                # 需要分组生成的大期不放入批处理，写入时同步生成
+                if planned is None or len(summary_chunks(planned[0])) > 1:
+                    continue
+                custom_id = f"s-{index}-{issue_index}"
+                job['summary_ids'][custom_id] = key
+                requests_params[custom_id] = build_summary_request(planned[0])
+        jobs.append(job)
+
+    # 所有期刊都已在断点记录中翻译完、小结也已写入时不再提交空批次
+    outputs = submit_message_batch(requests_params) if requests_params else {}
+
+    for job in jobs:
+        journal_data = job['journal_data']
+        journal_name = journal_data['Journal']
+        page_id = journal_data['page_id']
+        print(f"\n写入期刊: {journal_name}")
+
+        translations = job['translations']
+        failures = {}
+        for custom_id, batch in job['translation_ids'].items():
+            if custom_id in outputs:
+                try:
+                    parsed = parse_batch_translation(outputs[custom_id], batch)
+                except Exception as e:
+                    print(f"  解析批处理结果 {custom_id} 失败: {e}")
+                    parsed = {}
+                for article in batch:
+                    if article_key(article) in parsed:
+                        get_translation_cache().put(article, parsed[article_key(article)])
+                translations.update(parsed)
+            missing = [a for a in batch if article_key(a) not in translations]
+            if missing:
+                # 批处理中失败或格式错误的条目回退到同步翻译
+                translations.update(translate_batch(missing, failures))
+            get_run_checkpoint().record_translations(page_id, batch, translations)
+
+        ticket = get_outbox_writer().open_journal(journal_data, job['window'])
+        ticket.previously_written = job['written_count']
+        ticket.article_count = job['written_count'] + len(job['articles'])
+        ticket.deferred = job['deferred']
+        retry_untranslated(ticket, queue_translated_articles(ticket, job['articles'], translations), failures)
+
+        summaries = {
+            key: outputs[custom_id].strip()
+            for custom_id, key in job['summary_ids'].items()
+            if outputs.get(custom_id, '').strip()
+        }
+        queue_issue_summaries(ticket, job['issue_groups'], summaries)
+        ticket.close()
 
 # ============== 主流程 ==============
 
-def process_journal(journal_data: Dict):
-    """处理单个期刊的订阅"""
+def get_fetch_window(journal_data: Dict, update_status: bool = True) -> Optional[Dict]:
+    """确定期刊的抓取窗口（ISSN、起始日期、增量同步水位线）；缺少ISSN时记录状态并返回None"""
     journal_name = journal_data['Journal']
-    page_id = journal_data['page_id']
     issn = journal_data.get('Online ISSN') or journal_data.get('Print ISSN')
 
     # 优先使用"最后更新日期"，如果没有则使用"起始抓取日期"
@@ -507,91 +2973,655 @@ def process_journal(journal_data: Dict):
 
     if not issn:
         print(f"期刊 {journal_name} 缺少ISSN，跳过")
-        update_subscription_status(page_id, journal_name, "错误：缺少ISSN")
-        return
+        if update_status:
+            update_subscription_status(journal_data['page_id'], journal_name, "错误：缺少ISSN")
+        return None
 
     if not from_date:
         from_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
 
-    print(f"\n处理期刊: {journal_name} (ISSN: {issn})")
-    print(f"抓取日期: {from_date} 至今")
-
-    articles = fetch_articles_by_issn(issn, from_date)
-
-    if not articles:
-        print(f"  未找到新文章")
-        # 没有新文章，只更新处理日期和状态，不更新"最后更新日期"
-        update_subscription_status(page_id, journal_name, "成功：无新文章")
-        return
-    
-    print(f"  找到 {len(articles)} 篇文章")
-    
-    success_count = 0
+    window = {'issn': issn, 'from_date': from_date, 'watermark': None, 'latest': None,
+              'start_date': journal_data.get('起始抓取日期'), 'journal': journal_name,
+              'keywords': KeywordFilter(journal_data.get('包含关键词', ''), journal_data.get('排除关键词', ''))}
+    if CROSSREF_SYNC_MODE in CROSSREF_SYNC_FIELDS:
+        # 增量同步：从上次记录的水位线开始，首次运行时从抓取起始日期开始
+        window['watermark'] = journal_data.get('增量同步时间') or from_date
+    return window
+
+def track_sync_watermark(articles: Iterable[Dict], window: Dict) -> Iterator[Dict]:
+    """跳过不晚于水位线的文章，并记录本次见到的最新索引/更新时间"""
+    field = CROSSREF_SYNC_FIELDS[CROSSREF_SYNC_MODE]
+    since = parse_timestamp(window['watermark'])
     for article in articles:
-        try:
-            print(f"  处理: {article['title'][:50]}...")
-            enriched = translate_and_extract(article['title'], article['abstract'])
-            
-            article_data = {
-                **article,
-                **enriched
-            }
-            
-            if write_article(article_data):
-                success_count += 1
-            
-        except Exception as e:
-            print(f"    处理文章失败: {e}")
+        stamp = parse_timestamp(article.get(field))
+        if stamp and since and stamp <= since:
             continue
-    
-    print(f"  成功推送 {success_count}/{len(articles)} 篇文章")
-    
-    # 按issue分组生成小结
-    issue_groups = {}
-    for article in articles:
-        key = (article.get('volume', ''), article.get('issue', ''))
-        if key not in issue_groups:
-            issue_groups[key] = []
-        issue_groups[key].append(article)
-    
+        if stamp and (window['latest'] is None or stamp > window['latest']):
+            window['latest'] = stamp
+        yield article
+
+def window_query(window: Dict) -> Dict:
+    """抓取窗口对应的Crossref日期过滤条件（iter_articles_by_issns 的关键字参数）"""
+    if not window['watermark']:
+        return {'from_date': window['from_date']}
+
+    # 按索引/更新时间过滤，晚收录的旧文章也能抓到。索引/更新时间在重新索引或补充元数据时也会变化，
+    # 出版日期下限取"起始抓取日期"和清理保留期中较晚的一个：已被清理（DOI去重也查不到）的旧文章不会被重新推送
+    since = parse_timestamp(window['watermark'])
+    horizon = (datetime.now() - timedelta(days=ARTICLE_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    return {
+        'from_date': since.strftime("%Y-%m-%d"),
+        'date_filter': CROSSREF_SYNC_MODE,
+        'extra_filters': {'from-pub-date': max((window['start_date'] or '')[:10], horizon)}
+    }
+
+def iter_window_articles(window: Dict, prefetched: Optional[Iterable[Dict]] = None) -> Iterator[Dict]:
+    """抓取窗口内尚未推送过的文章；prefetched 为合并查询预先抓到的该期刊文章"""
+    if prefetched is not None:
+        articles = prefetched
+    else:
+        articles = iter_articles_by_issn(window['issn'], **window_query(window))
+    if window['watermark']:
+        articles = track_sync_watermark(articles, window)
+    # 关键词过滤放在水位线之后（被过滤的文章也推进水位线）、DOI去重之前
+    if window['keywords'].active:
+        articles = window['keywords'].apply(articles, window['journal'])
+    return doi_index.filter_new(articles)
+
+def print_keyword_stats(window: Dict):
+    """打印期刊的关键词过滤结果"""
+    if window['keywords'].active:
+        stats = window['keywords'].stats
+        print(f"  关键词过滤: 匹配 {stats['matched']} 篇, 跳过 {stats['skipped']} 篇")
+
+def subscription_issns(journal_data: Dict) -> List[str]:
+    """订阅的所有ISSN（在线和印刷），用于把合并查询的结果分回期刊"""
+    issns = [journal_data.get('Online ISSN'), journal_data.get('Print ISSN')]
+    return [i.strip().upper() for i in issns if i and i.strip()]
+
+def plan_fetch_groups(subscriptions: List[Dict], max_issns: int = CROSSREF_COALESCE,
+                      update_status: bool = True) -> List[List[Dict]]:
+    """把抓取窗口相同的期刊合并成组，每组最多 max_issns 个期刊
+
+    只合并 Crossref 日期过滤条件完全相同的期刊（不对日期分桶）；返回的每一项为 {'journal_data', 'window'}，
+    缺少ISSN的期刊在这里就记录状态并跳过。
+    """
+    buckets = {}
+    for journal_data in subscriptions:
+        window = get_fetch_window(journal_data, update_status)
+        if not window:
+            continue
+        key = json.dumps(window_query(window), sort_keys=True)
+        buckets.setdefault(key, []).append({'journal_data': journal_data, 'window': window})
+
+    groups = []
+    for jobs in buckets.values():
+        for start in range(0, len(jobs), max_issns):
+            groups.append(jobs[start:start + max_issns])
+    return groups
+
+def fetch_group_articles(group: List[Dict]) -> List[Dict]:
+    """用一个查询抓取整组期刊的文章，按条目中的ISSN分回各期刊
+
+    返回的任务带有 'articles'；合并查询失败时不带，由各期刊单独抓取。
+    """
+    owners = {}
+    for job in group:
+        job['articles'] = []
+        for issn in subscription_issns(job['journal_data']):
+            owners.setdefault(issn, []).append(job)
+
+    issns = [job['window']['issn'] for job in group]
+    print(f"\n合并查询 {len(issns)} 个期刊: {', '.join(issns)}")
+    try:
+        for article in iter_articles_by_issns(issns, **window_query(group[0]['window'])):
+            matched = {id(job): job for issn in article.get('issns', []) for job in owners.get(issn, [])}
+            for job in matched.values():
+                job['articles'].append(article)
+    except Exception as e:
+        print(f"  合并查询失败，改为逐个期刊抓取: {e}")
+        for job in group:
+            job.pop('articles', None)
+    return group
+
+def iter_journal_jobs(subscriptions: List[Dict], update_status: bool = True) -> Iterator[Dict]:
+    """生成每个期刊的处理任务（process_journal 的关键字参数）；开启合并查询时按组预先抓取文章
+
+    任务按需生成，调用方取下一组时才抓取；续跑时已完成的期刊和时间预算用完后的组不再抓取，
+    直接交给 process_journal 记录跳过或推迟。
+    """
+    if CROSSREF_COALESCE <= 1:
+        for journal_data in subscriptions:
+            yield {'journal_data': journal_data}
+        return
+
+    pending = []
+    for journal_data in subscriptions:
+        if RESUME_RUN and get_run_checkpoint().is_done(journal_data['page_id']):
+            yield {'journal_data': journal_data}
+        else:
+            pending.append(journal_data)
+
+    for group in plan_fetch_groups(pending, update_status=update_status):
+        if run_budget.expired():
+            yield from group
+        else:
+            yield from fetch_group_articles(group)
+
+def window_watermark(window: Dict) -> Optional[str]:
+    """本次运行后应记录的水位线（没有新的索引/更新时间时为None）"""
+    if window['latest']:
+        return window['latest'].isoformat()
+    return None
+
+def issue_entry(article: Dict) -> Dict:
+    """分组和生成小结需要的字段"""
+    return {
+        'doi': article.get('doi', ''),
+        'volume': article.get('volume', ''),
+        'issue': article.get('issue', ''),
+        'title': article.get('title', ''),
+        'abstract': article.get('abstract', ''),
+        'year': article.get('year')
+    }
+
+def add_to_issue_group(issue_groups: Dict, article: Dict):
+    """按 (volume, issue) 分组，只保留生成小结需要的字段"""
+    entry = issue_entry(article)
+    issue_groups.setdefault((entry['volume'], entry['issue']), []).append(entry)
+
+def plan_issue_summary(journal_name: str, volume: str, issue: str, issue_articles: List[Dict]) -> Optional[tuple]:
+    """合并这一期以前抓到过的文章，返回 (这一期的全部文章, 文章集合指纹)；与上次生成小结时相同则返回None"""
+    state = get_issue_state()
+    state.add_articles(journal_name, volume, issue, issue_articles)
+    entries = state.articles(journal_name, volume, issue)
+    fingerprint = IssueState.fingerprint(article_key(entry) for entry in entries)
+    if fingerprint == state.summary_fingerprint(journal_name, volume, issue):
+        return None
+    return entries, fingerprint
+
+def queue_issue_summaries(ticket: JournalTicket, issue_groups: Dict, summaries: Optional[Dict] = None):
+    """为每一期生成小结并放入发件箱；summaries 中已有的小结直接使用，断点记录中已写入、
+    文章集合与上次生成时相同的小结跳过"""
+    summaries = summaries or {}
+    journal_name = ticket.journal_data['Journal']
+    page_id = ticket.journal_data['page_id']
+    checkpoint = get_run_checkpoint()
+
+    # 以前生成或写入失败的小结一并重试
+    issue_groups = dict(issue_groups)
+    for key in get_issue_state().stale_issues(journal_name):
+        issue_groups.setdefault(key, [])
+
     for (volume, issue), issue_articles in issue_groups.items():
         if volume and issue:
-            print(f"  生成小结: Volume {volume}, Issue {issue}")
-            summary = generate_issue_summary(issue_articles)
-            
+            if checkpoint.summary_done(page_id, volume, issue):
+                print(f"  跳过已写入的小结: Volume {volume}, Issue {issue}")
+                continue
+            planned = plan_issue_summary(journal_name, volume, issue, issue_articles)
+            if planned is None:
+                print(f"  小结未变化，跳过: Volume {volume}, Issue {issue}")
+                metrics.inc('paperalert_issue_summaries_total', result='unchanged')
+                continue
+            issue_articles, fingerprint = planned
+            print(f"  生成小结: Volume {volume}, Issue {issue}（共 {len(issue_articles)} 篇）")
+            summary = summaries.get((volume, issue)) or generate_issue_summary(issue_articles)
+            if summary is None:
+                print(f"  小结生成失败，下次运行重试: Volume {volume}, Issue {issue}")
+                metrics.inc('paperalert_issue_summaries_total', result='failed')
+                continue
+            metrics.inc('paperalert_issue_summaries_total', result='generated')
+
             summary_data = {
                 'journal': journal_name,
                 'volume': volume,
                 'issue': issue,
                 'year': issue_articles[0].get('year'),
                 'article_count': len(issue_articles),
-                'summary': summary
+                'summary': summary,
+                'fingerprint': fingerprint
             }
             
-            write_summary(summary_data)
+            get_outbox_writer().put(ticket, 'summary', f"{volume}|{issue}", summary_data)
+
+def report_journal_status(page_id: str, journal_name: str, success_count: int, article_count: int, window: Dict,
+                          deferred: Optional[str] = None, untranslated: int = 0, translation_failed: int = 0):
+    """根据推送结果更新订阅状态；deferred 为推迟原因或有文章因Claude请求失败未翻译时，不前移日期和水位线，
+    剩余文章下次运行继续。translation_failed 为以英文原文写入的文章数"""
+    if deferred:
+        print(f"  剩余文章超出本次运行的{deferred}，推迟到下次运行")
+        run_budget.record_deferred()
+        metrics.inc('paperalert_deferred_journals_total', reason=deferred)
+        update_subscription_status(page_id, journal_name,
+                                   f"已推迟：推送{success_count}篇，剩余文章超出本次运行的{deferred}，下次运行继续")
+        return
+    if untranslated:
+        print(f"  {untranslated} 篇文章因Claude请求失败未翻译，推迟到下次运行")
+        metrics.inc('paperalert_deferred_journals_total', reason='Claude不可用')
+        update_subscription_status(page_id, journal_name,
+                                   f"已推迟：推送{success_count}篇，{untranslated}篇文章因Claude请求失败"
+                                   f"（限流、过载或API错误）未翻译，下次运行继续")
+        return
 
     # 生成状态信息
     status = f"成功：推送{success_count}篇文章"
+    if translation_failed:
+        status += f"（{translation_failed}篇翻译失败，使用英文原文）"
+
+    # 增量同步水位线只在全部推送成功时前移，失败的文章下次还能被抓到
+    sync_watermark = window_watermark(window) if success_count == article_count else None
 
     # 只有成功推送文章时才更新"最后更新日期"
     if success_count > 0:
-        update_subscription_status(page_id, journal_name, status, datetime.now().strftime("%Y-%m-%d"))
+        update_subscription_status(page_id, journal_name, status, datetime.now().strftime("%Y-%m-%d"),
+                                   sync_watermark=sync_watermark)
     else:
         # 找到文章但推送失败，不更新"最后更新日期"
         update_subscription_status(page_id, journal_name, "失败：找到文章但推送失败")
 
-def main():
-    """主函数"""
-    print("=" * 60)
-    print("期刊订阅系统 - 开始运行")
-    print(f"运行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 60)
+def record_journal_metrics(journal_name: str, article_count: int, success_count: int):
+    """记录单个期刊的新文章数和推送成功数"""
+    metrics.inc('paperalert_articles_total', article_count, journal=journal_name, result='new')
+    metrics.inc('paperalert_articles_total', success_count, journal=journal_name, result='pushed')
+    metrics.event('journal', journal=journal_name, articles=article_count, pushed=success_count)
+
+def queue_translated_articles(ticket: JournalTicket, articles: List[Dict],
+                              translations: Dict[str, Dict[str, str]]) -> List[Dict]:
+    """合并翻译结果并放入发件箱，由写入线程写入各输出目标；返回没有译文的文章"""
+    writer = get_outbox_writer()
+    untranslated = []
+    for article in articles:
+        if article_key(article) not in translations:
+            untranslated.append(article)
+            continue
+        print(f"  处理: {article['title'][:50]}...")
+        article_data = {
+            **article,
+            **translations[article_key(article)]
+        }
+        writer.put(ticket, 'article', article_key(article), article_data)
+    return untranslated
+
+def retry_untranslated(ticket: JournalTicket, articles: List[Dict], failures: Optional[Dict[str, str]] = None):
+    """重试队列：期刊其余文章处理完后再翻译一次
+
+    因 Claude 请求失败（限流、过载、API 错误）仍未翻译的文章不写入，期刊记为推迟，下次运行重新抓取；
+    请求成功但输出无法解析的文章重试也不会成功，以英文原文写入并记录，避免期刊一直推迟。
+    failures 是第一次翻译时记录的失败原因，重试的结果会覆盖它。
+    """
+    if not articles:
+        return
+    print(f"  重试 {len(articles)} 篇翻译失败的文章...")
+    failures = {} if failures is None else failures
+    translations = translate_with_checkpoint(ticket.journal_data['page_id'], articles, failures)
+    for article in articles:
+        key = article_key(article)
+        if key not in translations and failures.get(key) == 'error':
+            print(f"  翻译失败，写入英文原文: {article['title'][:50]}...")
+            translations[key] = {'title_cn': article['title'], 'abstract_cn': article.get('abstract', '')}
+            ticket.translation_failed += 1
+    if ticket.translation_failed:
+        metrics.inc('paperalert_translation_failures_total', ticket.translation_failed)
+    ticket.untranslated = len(queue_translated_articles(ticket, articles, translations))
+    if ticket.untranslated:
+        metrics.inc('paperalert_untranslated_articles_total', ticket.untranslated)
+
+def finish_journal(ticket: JournalTicket):
+    """期刊的文章和小结都已写入（或留在发件箱）后，根据写入结果更新订阅状态"""
+    journal_data = ticket.journal_data
+    journal_name = journal_data['Journal']
+    page_id = journal_data['page_id']
+    success_count = ticket.previously_written + ticket.written['article']
+
+    if ticket.fetch_error:
+        # 抓取中断：不更新"最后更新日期"，下次从同一日期重新抓取
+        update_subscription_status(page_id, journal_name, f"失败：抓取中断（已推送{success_count}篇）")
+        return
+
+    if not ticket.article_count and not ticket.deferred:
+        # 没有新文章，只更新处理日期和状态，不更新"最后更新日期"
+        update_subscription_status(page_id, journal_name, "成功：无新文章",
+                                   sync_watermark=window_watermark(ticket.window))
+        record_journal_metrics(journal_name, 0, 0)
+        get_run_checkpoint().mark_done(page_id)
+        return
+
+    print(f"  {journal_name}: 成功推送 {success_count}/{ticket.article_count} 篇文章")
+    report_journal_status(page_id, journal_name, success_count, ticket.article_count, ticket.window,
+                          ticket.deferred, ticket.untranslated, ticket.translation_failed)
+    record_journal_metrics(journal_name, ticket.article_count, success_count)
+    get_run_checkpoint().mark_done(page_id)
+
+def restore_checkpoint(page_id: str, issue_groups: Dict) -> Dict[str, Dict]:
+    """续跑时把上次已写入的文章计入本期分组，返回 {article_key: 文章信息}"""
+    if not RESUME_RUN:
+        return {}
+    written = get_run_checkpoint().written(page_id)
+    for entry in written.values():
+        add_to_issue_group(issue_groups, entry)
+    if written:
+        print(f"  续跑：上次已写入 {len(written)} 篇文章")
+    return written
+
+def skip_written(articles: Iterable[Dict], written: Dict[str, Dict]) -> Iterator[Dict]:
+    """跳过断点记录中已写入的文章"""
+    for article in articles:
+        if article_key(article) not in written:
+            yield article
+
+def translate_with_checkpoint(page_id: str, articles: List[Dict],
+                              failures: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, str]]:
+    """翻译一批文章：断点记录中已翻译的直接使用，新翻译的结果记入断点记录"""
+    checkpoint = get_run_checkpoint()
+    translations, misses = checkpoint.translations(page_id, articles)
+    if misses:
+        fresh = translate_articles(misses, failures)
+        checkpoint.record_translations(page_id, misses, fresh)
+        translations.update(fresh)
+    return translations
+
+def process_journal(journal_data: Dict, window: Optional[Dict] = None, articles: Optional[List[Dict]] = None):
+    """处理单个期刊的订阅；window 和 articles 由合并查询预先提供时不再单独抓取"""
+    journal_name = journal_data['Journal']
+    page_id = journal_data['page_id']
+
+    allowance = run_budget.allocate(page_id)
+    if RESUME_RUN and get_run_checkpoint().is_done(page_id):
+        print(f"\n跳过期刊: {journal_name}（上次运行已完成）")
+        return
+
+    window = window or get_fetch_window(journal_data)
+    if not window:
+        return
+    issn = window['issn']
+
+    print(f"\n处理期刊: {journal_name} (ISSN: {issn})")
+    if window['watermark']:
+        print(f"增量同步: {CROSSREF_SYNC_MODE} 晚于 {window['watermark']}")
+    else:
+        print(f"抓取日期: {window['from_date']} 至今")
+
+    # 翻译好的文章和小结放入发件箱，由写入线程写入各输出目标；全部写完后 finish_journal 更新订阅状态
+    ticket = get_outbox_writer().open_journal(journal_data, window)
+    issue_groups = {}
+    written = restore_checkpoint(page_id, issue_groups)
+    ticket.article_count = ticket.previously_written = len(written)
 
-    # 先清理超过30天的旧文章
+    retry_queue = []
+    failures = {}
     try:
-        clean_old_articles(days=30)
+        fetched = skip_written(iter_window_articles(window, articles), written)
+        for batch in iter_translation_batches(allowance.admit(fetched, translation_known(page_id))):
+            ticket.article_count += len(batch)
+            for article in batch:
+                add_to_issue_group(issue_groups, article)
+
+            print(f"  翻译 {len(batch)} 篇文章...")
+            translations = translate_with_checkpoint(page_id, batch, failures)
+            retry_queue.extend(queue_translated_articles(ticket, batch, translations))
+        retry_untranslated(ticket, retry_queue, failures)
     except Exception as e:
-        print(f"清理旧文章失败: {e}")
+        print(f"  抓取ISSN {issn} 文章失败: {e}")
+        ticket.fetch_error = str(e)
+        ticket.close()
+        return
+
+    print_keyword_stats(window)
+    ticket.deferred = allowance.deferred
+    if not ticket.article_count and not ticket.deferred:
+        print(f"  未找到新文章")
+    # 按issue分组生成小结（没有新文章时只重试以前失败的小结）
+    queue_issue_summaries(ticket, issue_groups)
+    ticket.close()
+
+def run_fetch_only(subscriptions: List[Dict]):
+    """只从Crossref抓取并统计新文章，不翻译、不写入Notion"""
+    total = 0
+    for job in iter_journal_jobs(subscriptions, update_status=False):
+        journal_data = job['journal_data']
+        window = job.get('window') or get_fetch_window(journal_data, update_status=False)
+        if not window:
+            continue
+        try:
+            count = sum(1 for _ in iter_window_articles(window, job.get('articles')))
+        except Exception as e:
+            print(f"  {journal_data['Journal']}: 抓取失败: {e}")
+            continue
+        total += count
+        print(f"  {journal_data['Journal']} (ISSN: {window['issn']}): {count} 篇新文章")
+        print_keyword_stats(window)
+    print(f"\n共 {total} 篇新文章")
+
+def run_translate_only(subscriptions: List[Dict]):
+    """抓取并翻译新文章，只写入本地翻译缓存，不写入Notion（用于预热缓存）"""
+    for job in iter_journal_jobs(subscriptions, update_status=False):
+        journal_data = job['journal_data']
+        window = job.get('window') or get_fetch_window(journal_data, update_status=False)
+        if not window:
+            continue
+        print(f"\n翻译期刊: {journal_data['Journal']} (ISSN: {window['issn']})")
+        try:
+            for batch in iter_translation_batches(iter_window_articles(window, job.get('articles'))):
+                translations = translate_articles(batch)
+                print(f"  已翻译 {len(translations)}/{len(batch)} 篇")
+        except Exception as e:
+            print(f"  抓取ISSN {window['issn']} 文章失败: {e}")
+
+def run_dry_run(subscriptions: List[Dict]):
+    """只打印每个期刊的抓取计划，不访问Crossref和Claude"""
+    for journal_data in subscriptions:
+        window = get_fetch_window(journal_data, update_status=False)
+        if not window:
+            continue
+        query = window_query(window)
+        print(f"  {journal_data['Journal']} (ISSN: {window['issn']}): "
+              f"{query.get('date_filter', 'pub-date')} 自 {query['from_date']}")
+    if CROSSREF_COALESCE > 1:
+        groups = plan_fetch_groups(subscriptions, update_status=False)
+        print(f"\n合并查询: {len(subscriptions)} 个期刊 → {len(groups)} 个Crossref查询")
+
+def run_sync(subscriptions: List[Dict]):
+    """完整同步：抓取、翻译、推送并更新订阅状态"""
+    subscriptions = run_budget.plan(subscriptions)
+    if run_budget.token_budget or run_budget.time_budget:
+        print(f"运行预算: token {run_budget.token_budget or '不限'}, "
+              f"时间 {f'{run_budget.time_budget:.0f} 秒' if run_budget.time_budget else '不限'}")
+
+    # 输出目标不可用或DOI索引加载不完整时中止同步，避免重复推送
+    for sink in get_sinks():
+        sink.check()
+    try:
+        doi_index.load()
+    except Exception as e:
+        raise RuntimeError(f"加载已推送文章的DOI失败，本次不同步: {e}") from e
+
+    # 先写完上次运行留在发件箱中的条目，避免和本次重新抓到的文章重复写入
+    writer = get_outbox_writer()
+    writer.drain()
+
+    try:
+        if MESSAGE_BATCH_MODE:
+            print("使用 Message Batches 离线批处理模式")
+            process_journals_in_message_batch(subscriptions)
+        elif JOURNAL_WORKERS > 1:
+            print(f"并发处理期刊: {JOURNAL_WORKERS} 个线程")
+            process_journals_concurrently(iter_journal_jobs(subscriptions), JOURNAL_WORKERS)
+        else:
+            for job in iter_journal_jobs(subscriptions):
+                process_journal_isolated(job)
+    finally:
+        # 等待发件箱写完（写入失败的条目留到下次运行）
+        writer.stop()
+
+def run_replay(source: str, include_summaries: bool = False):
+    """把本地 SQLite 输出目标中的文章补写到Notion（按DOI跳过Notion中已有的文章）"""
+    local = SQLiteSink(source)
+    notion = NotionSink()
+    known = {DOIIndex.normalize(doi) for doi in notion.known_dois()}
+    print(f"Notion中已有 {len(known)} 篇文章")
+
+    kinds = ['article', 'summary'] if include_summaries else ['article']
+    for kind in kinds:
+        table = SINK_TABLES[kind]
+        written = skipped = failed = 0
+        for row in local.rows(table):
+            data = {key: '' if value is None else value for key, value in row.items()}
+            # SQLite 中按文本保存，Notion 的数字字段需要转换回来
+            for field in ('year', 'article_count'):
+                if field in data:
+                    data[field] = int(data[field]) if str(data[field]).isdigit() else None
+            if kind == 'article' and data['doi'] and DOIIndex.normalize(data['doi']) in known:
+                skipped += 1
+                continue
+            try:
+                ok = notion.write(kind, data)
+            except Exception as e:
+                print(f"  写入失败: {e}")
+                ok = False
+            if ok:
+                written += 1
+            else:
+                failed += 1
+        print(f"{table}: 写入 {written} 条, 已存在跳过 {skipped} 条, 失败 {failed} 条")
+    local.close()
+
+def default_replay_source() -> Optional[str]:
+    """配置中第一个 SQLite 输出目标的路径"""
+    for spec in OUTPUT_SINKS:
+        if spec.get('type') == 'sqlite' and spec.get('path'):
+            return spec['path']
+    return None
+
+def print_run_stats():
+    """打印本次运行中实际用到的客户端的统计信息"""
+    if _notion_client:
+        print(f"\nNotion请求: {_notion_client.stats['requests']} 次, "
+              f"重试 {_notion_client.stats['retries']} 次, "
+              f"限流等待 {_notion_client.stats['throttled_seconds']:.1f} 秒")
+    if doi_index.stats['known'] or doi_index.stats['skipped']:
+        print(f"DOI去重: 已推送 {doi_index.stats['known']} 篇, 本次跳过 {doi_index.stats['skipped']} 篇")
+    keywords = {result: int(metrics.total('paperalert_keyword_filter_total', result=result))
+                for result in ('matched', 'skipped')}
+    if keywords['matched'] or keywords['skipped']:
+        print(f"关键词过滤: 匹配 {keywords['matched']} 篇, 跳过 {keywords['skipped']} 篇")
+    issues = {result: int(metrics.total('paperalert_issue_summaries_total', result=result))
+              for result in ('generated', 'unchanged', 'failed')}
+    if any(issues.values()):
+        print(f"期刊小结: 生成 {issues['generated']} 期, 文章未变化跳过 {issues['unchanged']} 期, "
+              f"生成失败 {issues['failed']} 期")
+    if _claude_client:
+        tokens = {kind: int(metrics.total('paperalert_claude_tokens_total', type=kind))
+                  for kind in ('input', 'output', 'cache_write', 'cache_read')}
+        print(f"Claude token: 输入 {tokens['input']}, 输出 {tokens['output']}, "
+              f"提示词缓存写入 {tokens['cache_write']}, 缓存读取 {tokens['cache_read']}")
+    if claude_concurrency.stats['peak']:
+        print(f"Claude并发: 当前上限 {claude_concurrency.limit:.1f}, 峰值 {claude_concurrency.stats['peak']}, "
+              f"限流 {claude_concurrency.stats['throttled']} 次（暂停 {claude_concurrency.stats['throttled_seconds']:.1f} 秒）, "
+              f"重试 {claude_concurrency.stats['retries']} 次")
+    untranslated = int(metrics.total('paperalert_untranslated_articles_total'))
+    if untranslated:
+        print(f"未翻译文章: {untranslated} 篇，留待下次运行")
+    translation_failed = int(metrics.total('paperalert_translation_failures_total'))
+    if translation_failed:
+        print(f"翻译失败: {translation_failed} 篇，已以英文原文写入")
+    if _outbox_writer:
+        remaining = len(_outbox_writer.outbox.pending())
+        print(f"发件箱: 写入 {_outbox_writer.stats['written']} 条, 重试 {_outbox_writer.stats['retries']} 次, "
+              f"留待下次运行 {remaining} 条")
+    if run_budget.spent or run_budget.stats['deferred']:
+        print(f"运行预算: 估算消耗 {run_budget.spent}/{run_budget.token_budget or '不限'} tokens, "
+              f"推迟 {run_budget.stats['deferred']} 个期刊")
+    if _translation_cache:
+        print(f"翻译缓存: 命中 {_translation_cache.stats['hits']} 次, "
+              f"未命中 {_translation_cache.stats['misses']} 次, "
+              f"写入 {_translation_cache.stats['writes']} 条")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="期刊订阅系统：抓取学术期刊文章，翻译后推送到Notion")
+    subparsers = parser.add_subparsers(dest='command')
+
+    sync_parser = subparsers.add_parser('sync', help="完整同步（默认）：清理旧文章、抓取、翻译、推送")
+    sync_parser.add_argument('--workers', type=int, help="同时处理的期刊数（覆盖配置中的 run.workers）")
+    sync_parser.add_argument('--skip-clean', action='store_true', help="跳过清理旧文章")
+    sync_parser.add_argument('--token-budget', type=int, help="本次运行的token预算（覆盖配置中的 run.token_budget）")
+    sync_parser.add_argument('--time-budget', type=float,
+                             help="本次运行的时间预算（秒，覆盖配置中的 run.time_budget_seconds）")
+    sync_parser.add_argument('--resume', action='store_true',
+                             help="从上次中断的位置继续：跳过已完成的期刊、已写入的文章和小结")
+    fetch_parser = subparsers.add_parser('fetch-only', help="只抓取并统计新文章，不翻译、不写入Notion")
+    translate_parser = subparsers.add_parser('translate-only', help="抓取并翻译新文章，只写入本地翻译缓存")
+    clean_parser = subparsers.add_parser('clean', help="只清理超过指定天数的文章记录")
+    clean_parser.add_argument('--days', type=int, default=ARTICLE_RETENTION_DAYS,
+                              help=f"保留天数（默认{ARTICLE_RETENTION_DAYS}）")
+    clean_parser.add_argument('--time-budget', type=float, help="最长清理时间（秒），超时后下次运行继续")
+    dry_run_parser = subparsers.add_parser('dry-run', help="只读取订阅并打印抓取计划，不访问Crossref和Claude")
+    for shard_parser in (sync_parser, fetch_parser, translate_parser, dry_run_parser):
+        shard_parser.add_argument('--shard', type=parse_shard,
+                                  help="只处理 N 个分片中的第 i 片订阅（格式 i/N，覆盖配置中的 run.shard）")
+    replay_parser = subparsers.add_parser('replay', help="把本地 SQLite 输出目标中的文章补写到Notion")
+    replay_parser.add_argument('--source', help="SQLite 文件路径（默认使用配置中的 sqlite 输出目标）")
+    replay_parser.add_argument('--summaries', action='store_true', help="同时补写期刊小结（小结不去重）")
+    merge_parser = subparsers.add_parser('merge-metrics', help="合并各分片输出的 Prometheus 指标文件")
+    merge_parser.add_argument('files', nargs='+', help="各分片的指标文件")
+    merge_parser.add_argument('--output', help="合并结果的路径（默认为配置中的指标文件）")
+
+    # 不带子命令时默认执行 sync（兼容 python journal_subscription_v2.py 的用法）
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0] not in subparsers.choices and argv[0] not in ('-h', '--help')):
+        argv = ['sync'] + argv
+    return parser.parse_args(argv)
+
+def record_run_stats():
+    """把各客户端的累计统计写入运行指标"""
+    if _notion_client:
+        metrics.set('paperalert_notion_throttled_seconds', _notion_client.stats['throttled_seconds'])
+    if _translation_cache:
+        for name, value in _translation_cache.stats.items():
+            metrics.set('paperalert_translation_cache', value, result=name)
+    metrics.set('paperalert_doi_skipped', doi_index.stats['skipped'])
+    metrics.set('paperalert_budget_tokens_spent', run_budget.spent)
+    if _outbox_writer:
+        metrics.set('paperalert_outbox_pending', len(_outbox_writer.outbox.pending()))
+
+def run_command(args: argparse.Namespace):
+    """执行子命令"""
+    global JOURNAL_WORKERS, RESUME_RUN
+
+    if args.command == 'clean':
+        clean_old_articles(days=args.days, time_budget=args.time_budget)
+        return
+
+    if args.command == 'replay':
+        source = args.source or default_replay_source()
+        if not source:
+            print("未指定 --source，配置中也没有 sqlite 输出目标")
+            return
+        run_replay(source, args.summaries)
+        return
+
+    if args.command == 'sync':
+        if args.workers:
+            JOURNAL_WORKERS = max(args.workers, 1)
+        if args.token_budget is not None:
+            run_budget.token_budget = args.token_budget
+        if args.time_budget is not None:
+            run_budget.time_budget = args.time_budget
+        run_budget.begin()
+
+        # 不续跑时丢弃上次中断留下的断点记录
+        RESUME_RUN = args.resume
+        if not RESUME_RUN:
+            get_run_checkpoint().reset()
+
+        # 先清理超过保留天数的旧文章（分片运行时只由第0片清理）
+        if RUN_SHARD and RUN_SHARD[0] != 0:
+            print(f"分片 {RUN_SHARD[0]}/{RUN_SHARD[1]}: 旧文章由分片 0 清理")
+        elif not args.skip_clean:
+            try:
+                clean_old_articles(days=ARTICLE_RETENTION_DAYS)
+            except Exception as e:
+                print(f"清理旧文章失败: {e}")
 
     subscriptions = read_subscriptions()
 
@@ -601,12 +3631,64 @@ def main():
 
     print(f"\n找到 {len(subscriptions)} 个启用的订阅")
 
-    for sub in subscriptions:
-        try:
-            process_journal(sub)
-        except Exception as e:
-            print(f"处理期刊失败: {e}")
-            continue
+    if RUN_SHARD:
+        index, count = RUN_SHARD
+        subscriptions = [sub for sub in subscriptions if subscription_shard(sub['page_id'], count) == index]
+        print(f"分片 {index}/{count}: 处理其中 {len(subscriptions)} 个订阅")
+        metrics.set('paperalert_shard_subscriptions', len(subscriptions))
+        if not subscriptions:
+            return
+
+    if args.command == 'fetch-only':
+        run_fetch_only(subscriptions)
+    elif args.command == 'translate-only':
+        run_translate_only(subscriptions)
+    elif args.command == 'dry-run':
+        run_dry_run(subscriptions)
+    else:
+        run_sync(subscriptions)
+        # 正常跑完后清空断点记录；被中断时保留，供 --resume 使用
+        get_run_checkpoint().reset()
+
+def main(argv: Optional[List[str]] = None):
+    """主函数"""
+    args = parse_args(argv)
+
+    if args.command == 'merge-metrics':
+        output = args.output or METRICS_PROM_FILE
+        files = [path for path in args.files if os.path.abspath(path) != os.path.abspath(output)]
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(merge_prometheus(files))
+        print(f"已合并 {len(files)} 个指标文件 → {output}")
+        return
+
+    shard = getattr(args, 'shard', None) or (parse_shard(SHARD) if SHARD and hasattr(args, 'shard') else None)
+    if shard and shard[1] > 1:
+        use_shard(shard)
+
+    print("=" * 60)
+    label = f"{args.command}，分片 {RUN_SHARD[0]}/{RUN_SHARD[1]}" if RUN_SHARD else args.command
+    print(f"期刊订阅系统 - 开始运行 ({label})")
+    print(f"运行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 60)
+
+    metrics.open_log(METRICS_RUN_LOG)
+    metrics.event('run_start', command=args.command)
+    started = time.monotonic()
+    status = 'error'
+    try:
+        run_command(args)
+        status = 'ok'
+    finally:
+        close_sinks()
+        print_run_stats()
+        record_run_stats()
+        run_seconds = time.monotonic() - started
+        metrics.set('paperalert_run_seconds', run_seconds, command=args.command)
+        metrics.set('paperalert_run_success', 1 if status == 'ok' else 0, command=args.command)
+        metrics.event('run_end', command=args.command, status=status, seconds=round(run_seconds, 3))
+        metrics.close_log()
+        metrics.write_prometheus(METRICS_PROM_FILE)
 
     print("\n" + "=" * 60)
     print("运行完成")
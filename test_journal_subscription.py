@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+单元测试 - 不访问 Notion、Crossref 和 Claude，只测试主程序中的纯逻辑部分
+
+运行：python -m unittest test_journal_subscription
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import time
+import unittest
+
+import journal_subscription_v2 as sync
+
+
+def article(doi, title='', abstract=''):
+    return {'doi': doi, 'title': title, 'abstract': abstract}
+
+
+class KeywordFilterTest(unittest.TestCase):
+    """包含/排除关键词的匹配规则"""
+
+    def test_whole_word_and_prefix(self):
+        keywords = sync.KeywordFilter('CRISPR, immun*')
+        self.assertTrue(keywords.matches(article('1', 'CRISPR screens in mice')))
+        self.assertTrue(keywords.matches(article('2', 'Innate Immunity and aging')))
+        self.assertFalse(keywords.matches(article('3', 'CRISPRi libraries')))
+        self.assertFalse(keywords.matches(article('4', 'Community ecology')))
+
+    def test_exclude_wins_over_include(self):
+        keywords = sync.KeywordFilter('genome', 'erratum; correction')
+        self.assertTrue(keywords.matches(article('1', 'Genome assembly')))
+        self.assertFalse(keywords.matches(article('2', 'Correction: Genome assembly')))
+
+    def test_lone_wildcard_is_ignored(self):
+        keywords = sync.KeywordFilter('*', '**')
+        self.assertFalse(keywords.active)
+        keywords = sync.KeywordFilter('*, rice')
+        self.assertFalse(keywords.matches(article('1', 'Wheat yield')))
+        self.assertTrue(keywords.matches(article('2', 'Rice yield')))
+
+    def test_apply_counts_results(self):
+        keywords = sync.KeywordFilter('', 'retracted')
+        kept = list(keywords.apply([article('1', 'A'), article('2', 'Retracted: B'), article('3', 'C')]))
+        self.assertEqual([a['doi'] for a in kept], ['1', '3'])
+        self.assertEqual(keywords.stats, {'matched': 2, 'skipped': 1})
+
+
+class MergePrometheusTest(unittest.TestCase):
+    """分片指标合并：计数器和直方图相加，gauge 按分片分别保留"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_merge(self):
+        paths = [
+            self.write(f'paperalert.shard-{i}-of-2.prom',
+                       '# TYPE paperalert_articles_total counter\n'
+                       f'paperalert_articles_total{{result="ok"}} {i + 1}\n'
+                       '# TYPE paperalert_run_seconds gauge\n'
+                       f'paperalert_run_seconds{{command="sync"}} {10 * (i + 1)}\n'
+                       '# TYPE paperalert_request_seconds histogram\n'
+                       'paperalert_request_seconds_bucket{le="+Inf"} 2\n'
+                       'paperalert_request_seconds_count 2\n')
+            for i in range(2)
+        ]
+        lines = sync.merge_prometheus(paths).splitlines()
+        self.assertIn('paperalert_articles_total{result="ok"} 3', lines)
+        self.assertIn('paperalert_run_seconds{shard="shard-0-of-2",command="sync"} 10', lines)
+        self.assertIn('paperalert_run_seconds{shard="shard-1-of-2",command="sync"} 20', lines)
+        self.assertIn('paperalert_request_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('paperalert_request_seconds_count 4', lines)
+        self.assertEqual(lines.count('# TYPE paperalert_articles_total counter'), 1)
+
+
+class RunBudgetTest(unittest.TestCase):
+    """运行预算：按优先级分配份额，超出份额推迟，已有译文的文章不计费"""
+
+    def setUp(self):
+        self.articles = [article(f'10.1/{i}', 'T' * 40, 'A' * 400) for i in range(10)]
+        self.cost = sync.estimate_article_tokens(self.articles[0])
+
+    def subscriptions(self):
+        return [
+            {'page_id': 'low', 'Online ISSN': '0000-0001', '优先级': 0},
+            {'page_id': 'high', 'Online ISSN': '0000-0002', '优先级': 2},
+        ]
+
+    def test_plan_orders_by_priority(self):
+        budget = sync.RunBudget(token_budget=1000)
+        self.assertEqual([j['page_id'] for j in budget.plan(self.subscriptions())], ['high', 'low'])
+
+    def test_allocate_by_weight(self):
+        budget = sync.RunBudget(token_budget=self.cost * 8)
+        budget.plan(self.subscriptions())
+        self.assertEqual(budget.allocate('high').quota, self.cost * 6)
+
+    def test_quota_defers_the_rest(self):
+        budget = sync.RunBudget(token_budget=self.cost * 8)
+        budget.plan(self.subscriptions())
+        allowance = budget.allocate('high')
+        admitted = list(allowance.admit(self.articles))
+        self.assertEqual(len(admitted), 6)
+        self.assertEqual(allowance.deferred, 'token预算')
+        self.assertEqual(budget.spent, self.cost * 6)
+
+    def test_first_article_always_admitted(self):
+        budget = sync.RunBudget(token_budget=self.cost * 2)
+        budget.plan(self.subscriptions() + [{'page_id': f'j{i}', 'Online ISSN': f'1000-000{i}'} for i in range(8)])
+        allowance = budget.allocate('low')
+        self.assertLess(allowance.quota, self.cost)
+        self.assertEqual(len(list(allowance.admit(self.articles))), 1)
+
+    def test_translated_articles_are_free(self):
+        budget = sync.RunBudget(token_budget=self.cost * 2)
+        allowance = sync.JournalAllowance(budget, None)
+        cached = {a['doi'] for a in self.articles[:5]}
+        admitted = list(allowance.admit(self.articles, lambda a: a['doi'] in cached))
+        self.assertEqual(len(admitted), 7)
+        self.assertEqual(budget.spent, self.cost * 2)
+
+    def test_time_budget(self):
+        budget = sync.RunBudget(time_budget=0.01)
+        budget.begin()
+        time.sleep(0.02)
+        allowance = sync.JournalAllowance(budget, None)
+        self.assertEqual(list(allowance.admit(self.articles)), [])
+        self.assertEqual(allowance.deferred, '时间预算')
+
+
+class SubscriptionSnapshotTest(unittest.TestCase):
+    """订阅快照：运行自己的写入不算修改，写入之后的手动修改照常读到"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshot = sync.SubscriptionSnapshot(os.path.join(self.directory, 'subscriptions.sqlite3'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def row(page_id, edited, enabled=True, **values):
+        return {'page_id': page_id, 'last_edited_time': edited, 'Journal': page_id, '是否启用订阅': enabled, **values}
+
+    def test_delta_filter(self):
+        since = '2026-10-01T00:00:00+00:00'
+        self.assertEqual(self.snapshot.delta_filter(since),
+                         {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": since}})
+
+    def test_watermark_requires_snapshot_of_same_database(self):
+        self.assertIsNone(self.snapshot.watermark('db'))
+        self.snapshot.merge('db', [self.row('a', 't0')], 'w1', full=True)
+        self.assertEqual(self.snapshot.watermark('db'), 'w1')
+        self.assertIsNone(self.snapshot.watermark('other'))
+
+    def test_own_writes_are_not_changes(self):
+        self.snapshot.merge('db', [self.row('a', 't0'), self.row('b', 't0')], 'w1', full=True)
+        self.snapshot.record_write(self.row('a', 't1', 最近处理日期='2026-10-18'))
+        self.snapshot.record_write(self.row('b', 't2', 最近处理日期='2026-10-18'))
+        changed = self.snapshot.merge('db', [self.row('a', 't1'), self.row('b', 't2')], 'w2')
+        self.assertEqual(changed, 0)
+
+    def test_edit_after_own_write_is_read(self):
+        self.snapshot.merge('db', [self.row('a', 't0'), self.row('b', 't0')], 'w1', full=True)
+        self.snapshot.record_write(self.row('a', 't1'))
+        self.snapshot.record_write(self.row('b', 't3'))
+        # a 在运行写入之后、运行的最后一次写入（t3）之前被手动停用
+        changed = self.snapshot.merge('db', [self.row('a', 't2', enabled=False), self.row('b', 't3')], 'w2')
+        self.assertEqual(changed, 1)
+        self.assertEqual([s['page_id'] for s in self.snapshot.enabled()], ['b'])
+
+    def test_unchanged_and_remove(self):
+        self.snapshot.merge('db', [self.row('a', 't0', 最近处理状态='成功')], 'w1', full=True)
+        self.assertTrue(self.snapshot.unchanged('a', {'最近处理状态': '成功'}))
+        self.assertFalse(self.snapshot.unchanged('a', {'最近处理状态': '失败'}))
+        self.snapshot.remove('a')
+        self.assertEqual(self.snapshot.enabled(), [])
+
+
+class ParseBatchTranslationTest(unittest.TestCase):
+    """批量翻译结果只保留格式合法、对应本批文章的条目"""
+
+    def setUp(self):
+        self.articles = [article('10.1/a', 'A', 'abstract a'), article('10.1/b', 'B', ''), article('10.1/c', 'C', 'abstract c')]
+
+    def test_valid_entries(self):
+        text = '```json\n' + json.dumps([
+            {'doi': '10.1/a', 'title_cn': ' 甲 ', 'abstract_cn': '摘要甲'},
+            {'doi': '10.1/b', 'title_cn': '乙'},
+        ], ensure_ascii=False) + '\n```'
+        self.assertEqual(sync.parse_batch_translation(text, self.articles), {
+            '10.1/a': {'title_cn': '甲', 'abstract_cn': '摘要甲'},
+            '10.1/b': {'title_cn': '乙', 'abstract_cn': ''},
+        })
+
+    def test_invalid_entries_are_dropped(self):
+        text = json.dumps([
+            {'doi': '10.1/a', 'title_cn': '甲', 'abstract_cn': ''},
+            {'doi': '10.1/c', 'title_cn': '', 'abstract_cn': '摘要丙'},
+            {'doi': '10.1/x', 'title_cn': '未知', 'abstract_cn': ''},
+            '不是对象',
+        ], ensure_ascii=False)
+        self.assertEqual(sync.parse_batch_translation(text, self.articles), {})
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            sync.parse_batch_translation('{"doi": "10.1/a"}', self.articles)
+        with self.assertRaises(ValueError):
+            sync.parse_batch_translation('不是JSON', self.articles)
+
+
+class PlanFetchGroupsTest(unittest.TestCase):
+    """合并查询：只合并日期过滤条件完全相同的期刊，缺少ISSN的期刊跳过"""
+
+    @staticmethod
+    def journal(page_id, issn, last_update='2026-10-01'):
+        return {'page_id': page_id, 'Journal': page_id, 'Online ISSN': issn, '最后更新日期': last_update}
+
+    def test_groups(self):
+        subscriptions = [
+            self.journal('a', '0000-0001'),
+            self.journal('b', '0000-0002'),
+            self.journal('c', '0000-0003'),
+            self.journal('d', '0000-0004', last_update='2026-10-02'),
+            self.journal('e', ''),
+        ]
+        groups = sync.plan_fetch_groups(subscriptions, max_issns=2, update_status=False)
+        self.assertEqual([[job['journal_data']['page_id'] for job in group] for group in groups],
+                         [['a', 'b'], ['c'], ['d']])
+        self.assertEqual(groups[2][0]['window']['from_date'], '2026-10-02')
+
+
+if __name__ == '__main__':
+    unittest.main()